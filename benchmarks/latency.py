@@ -0,0 +1,427 @@
+#!/usr/bin/python3
+
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# End-to-end latency benchmark
+#
+# Starts a private D-Bus daemon with a scripted fake MPRIS player (running in
+# a separate process) and drives pidi_mpris.Player with the virtual display
+# and button backends. Prints the results as JSON.
+#
+# Usage: python3 benchmarks/latency.py [--iterations N] [--output FILE]
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+from time import monotonic, sleep
+
+import dbus
+import dbus.mainloop.glib
+import dbus.service
+from gi.repository import GLib
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from pidi_mpris.buttons import Button  # noqa: E402
+from pidi_mpris.main import read_conf  # noqa: E402
+from pidi_mpris.player import Player  # noqa: E402
+from pidi_mpris.screens import GifScreen  # noqa: E402
+
+
+BUS_NAME = 'org.mpris.MediaPlayer2.benchmark'
+OBJECT_PATH = '/org/mpris/MediaPlayer2'
+INTERFACE_ROOT = 'org.mpris.MediaPlayer2'
+INTERFACE_PLAYER = 'org.mpris.MediaPlayer2.Player'
+INTERFACE_PROPERTIES = 'org.freedesktop.DBus.Properties'
+INTERFACE_CONTROL = 'org.pidi_mpris.Benchmark'
+
+ARTWORK = [
+    os.path.join(ROOT_DIR, 'data/images/simon-noh-0rmby-3OTeI-unsplash.jpg'),
+    os.path.join(ROOT_DIR, 'data/images/namroud-gorguis-FZWivbri0Xk-unsplash.jpg')
+]
+GIF_IMAGE = os.path.join(ROOT_DIR, 'data/images/deployrainbows.gif')
+FONT_DIR = os.path.join(ROOT_DIR, 'data/fonts/OpenSans')
+
+FRAME_TIMEOUT = 5
+GIF_DURATION = 3
+
+
+class FakePlayer(dbus.service.Object):
+    '''
+    MPRIS player with a scripted track list. The benchmark changes tracks
+    through the control interface, which returns the (monotonic) time the
+    PropertiesChanged signal was emitted.
+    '''
+
+    def __init__(self, bus):
+        super().__init__(bus, OBJECT_PATH)
+        self._track = 0
+        self._nextCalls = []
+
+    def _metadata(self):
+        return dbus.Dictionary({
+            'mpris:trackid': dbus.ObjectPath('/org/pidi_mpris/track/{}'.format(self._track)),
+            'mpris:artUrl': 'file://' + ARTWORK[self._track % len(ARTWORK)],
+            'xesam:title': 'Title {}'.format(self._track),
+            'xesam:album': 'Album {}'.format(self._track),
+            'xesam:artist': dbus.Array(['Artist {}'.format(self._track)], signature='s')
+        }, signature='sv')
+
+    def _properties(self, interface):
+        if interface == INTERFACE_ROOT:
+            return {'HasTrackList': False, 'Identity': 'Benchmark'}
+        elif interface == INTERFACE_PLAYER:
+            return {'Metadata': self._metadata(), 'PlaybackStatus': 'Playing',
+                    'Position': dbus.Int64(0), 'Rate': 1.0}
+        return {}
+
+    def _changeTrack(self):
+        self._track += 1
+        emitted = monotonic()
+        self.PropertiesChanged(
+            INTERFACE_PLAYER, {'Metadata': self._metadata()}, [])
+        return emitted
+
+    @dbus.service.method(INTERFACE_PROPERTIES, in_signature='ss', out_signature='v')
+    def Get(self, interface, name):
+        properties = self._properties(interface)
+        if name not in properties:
+            raise dbus.exceptions.DBusException(
+                'Unknown property {}'.format(name),
+                name='org.freedesktop.DBus.Error.InvalidArgs')
+        return properties[name]
+
+    @dbus.service.method(INTERFACE_PROPERTIES, in_signature='s', out_signature='a{sv}')
+    def GetAll(self, interface):
+        return self._properties(interface)
+
+    @dbus.service.signal(INTERFACE_PROPERTIES, signature='sa{sv}as')
+    def PropertiesChanged(self, interface, changed, invalidated):
+        pass
+
+    @dbus.service.method(INTERFACE_PLAYER)
+    def Next(self):
+        self._nextCalls.append(monotonic())
+        self._changeTrack()
+
+    @dbus.service.method(INTERFACE_PLAYER)
+    def Previous(self):
+        self._changeTrack()
+
+    @dbus.service.method(INTERFACE_PLAYER)
+    def PlayPause(self):
+        pass
+
+    @dbus.service.method(INTERFACE_CONTROL, out_signature='d')
+    def ChangeTrack(self):
+        return self._changeTrack()
+
+    @dbus.service.method(INTERFACE_CONTROL, out_signature='ad')
+    def NextCalls(self):
+        return self._nextCalls
+
+
+def run_fake_player():
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.SessionBus()
+    name = dbus.service.BusName(BUS_NAME, bus)
+    player = FakePlayer(bus)  # noqa: F841
+
+    print('ready', flush=True)
+    GLib.MainLoop().run()
+    del name
+
+
+class FrameRecorder:
+    '''
+    Records the writes to the virtual display panel.
+    '''
+
+    def __init__(self, panel):
+        self._frames = []
+        self._condition = threading.Condition()
+        panel.frameHandler = self._onFrame
+
+    def _onFrame(self, frame):
+        with self._condition:
+            self._frames.append(frame)
+            self._condition.notify_all()
+
+    def waitForFrame(self, after, timeout=FRAME_TIMEOUT):
+        '''
+        Returns the end time of the first write started after the given time.
+        '''
+        deadline = monotonic() + timeout
+        with self._condition:
+            while True:
+                for frame in self._frames:
+                    if frame.startTime >= after:
+                        return frame.endTime
+
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise TimeoutError('No frame after {}'.format(after))
+                self._condition.wait(remaining)
+
+    def clear(self):
+        with self._condition:
+            self._frames = []
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'n': 0}
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+    return {
+        'n': len(samples),
+        'min': samples[0],
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'max': samples[-1]
+    }
+
+
+def to_ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def run_on_loop(fn):
+    '''
+    Runs fn on the GLib main loop (like all of the player's code) and waits
+    until it returned.
+    '''
+    done = threading.Event()
+    errors = []
+
+    def call():
+        try:
+            fn()
+        except Exception as e:
+            errors.append(e)
+        done.set()
+        return False
+
+    GLib.idle_add(call)
+    done.wait()
+    if errors:
+        raise errors[0]
+
+
+def benchmark_conf(cacheDir):
+    args = argparse.Namespace(
+        conf=os.devnull, log_level='WARNING', log_filename=None)
+    conf = read_conf(args)
+
+    conf['DEFAULT']['font_face_regular'] = os.path.join(
+        FONT_DIR, 'OpenSans-Regular.ttf')
+    conf['DEFAULT']['font_face_bold'] = os.path.join(
+        FONT_DIR, 'OpenSans-Bold.ttf')
+    conf['DEFAULT']['font_face_italic'] = os.path.join(
+        FONT_DIR, 'OpenSans-Italic.ttf')
+    conf['GENERAL']['turn_off_when_inactive'] = '0'
+    conf['ArtworkScreen']['fallback_image'] = ARTWORK[0]
+    conf['ArtworkScreen']['download_cache_dir'] = cacheDir
+    conf['GifScreen']['image'] = GIF_IMAGE
+    conf['Display']['backend'] = 'virtual'
+    conf['Buttons']['backend'] = 'virtual'
+    return conf
+
+
+def bench_track_changes(player, fakePlayer, recorder, iterations):
+    samples = []
+    for _i in range(iterations):
+        recorder.clear()
+        emitted = fakePlayer.ChangeTrack(dbus_interface=INTERFACE_CONTROL)
+        samples.append(to_ms(recorder.waitForFrame(emitted) - emitted))
+        sleep(0.1)
+    return samples
+
+
+def bench_screen_switches(player, recorder, iterations):
+    samples = []
+    for _i in range(iterations):
+        recorder.clear()
+        start = monotonic()
+        run_on_loop(player._switchToNextScreen)
+
+        # Until the previous screen was deactivated, it may still send frames
+        # (GIF frames, progress ticks)
+        frameTime = recorder.waitForFrame(player.screenSwitchTime)
+        samples.append(to_ms(frameTime - start))
+        sleep(0.2)
+    return samples
+
+
+def bench_artwork_loads(player, iterations):
+    cache = player._artworkCache
+    cold = []
+    warm = []
+    for i in range(iterations):
+        imageFile = ARTWORK[i % len(ARTWORK)]
+
+        cache._cache.clear()
+        start = monotonic()
+        cache.get(imageFile)
+        cold.append(to_ms(monotonic() - start))
+
+        start = monotonic()
+        cache.get(imageFile)
+        warm.append(to_ms(monotonic() - start))
+    return cold, warm
+
+
+def bench_button_next(player, fakePlayer, iterations):
+    gpio = player._buttons.gpio
+    pressed = []
+    for _i in range(iterations):
+        pressed.append(monotonic())
+        gpio.press(Button.X)
+        sleep(0.05)
+        gpio.release(Button.X)
+        sleep(0.25)
+
+    calls = fakePlayer.NextCalls(dbus_interface=INTERFACE_CONTROL)[-len(pressed):]
+    return [to_ms(call - press) for press, call in zip(pressed, calls)]
+
+
+def bench_gif_frame_rate(player):
+    display = player._display
+    while not isinstance(player._activeScreen, GifScreen):
+        GLib.idle_add(player._switchToNextScreen)
+        sleep(0.5)
+
+    sleep(0.5)
+    framesSent = display.framesSent
+    sleep(GIF_DURATION)
+    return (display.framesSent - framesSent) / GIF_DURATION
+
+
+def run_benchmark(iterations):
+    dbus.mainloop.glib.threads_init()
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+    loop = GLib.MainLoop()
+    loopThread = threading.Thread(name='glib', target=loop.run, daemon=True)
+    loopThread.start()
+
+    with tempfile.TemporaryDirectory() as cacheDir:
+        player = Player(BUS_NAME, benchmark_conf(cacheDir))
+        run_on_loop(player.init)
+        try:
+            fakePlayer = dbus.SessionBus().get_object(BUS_NAME, OBJECT_PATH)
+            recorder = FrameRecorder(player._display.panel)
+            sleep(1)
+
+            trackChanges = bench_track_changes(
+                player, fakePlayer, recorder, iterations)
+            buttonNext = bench_button_next(player, fakePlayer, iterations)
+            screenSwitches = bench_screen_switches(
+                player, recorder, iterations)
+            artworkCold, artworkWarm = bench_artwork_loads(player, iterations)
+            gifFrameRate = bench_gif_frame_rate(player)
+            displayStats = player._display.stats()
+        finally:
+            run_on_loop(player.deinit)
+            loop.quit()
+
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'iterations': iterations,
+        'unit': 'ms',
+        'results': {
+            'track_change': percentiles(trackChanges),
+            'button_next': percentiles(buttonNext),
+            'screen_switch': percentiles(screenSwitches),
+            'artwork_load_cold': percentiles(artworkCold),
+            'artwork_load_warm': percentiles(artworkWarm),
+            'gif_frame_rate': round(gifFrameRate, 2),
+            'display': displayStats
+        }
+    }
+
+
+def start_dbus_daemon():
+    daemon = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address'],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+    address = daemon.stdout.readline().strip()
+    os.environ['DBUS_SESSION_BUS_ADDRESS'] = address
+    return daemon
+
+
+def start_fake_player():
+    fakePlayer = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--fake-player'],
+                                  stdout=subprocess.PIPE, universal_newlines=True)
+    fakePlayer.stdout.readline()
+    return fakePlayer
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='pidi-mpris latency benchmark')
+    parser.add_argument('-n', '--iterations', type=int, default=50,
+                        help='Number of measurements per benchmark')
+    parser.add_argument('-o', '--output',
+                        help='Write results to this file (default: stdout)')
+    parser.add_argument('--fake-player', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.fake_player:
+        run_fake_player()
+        return
+
+    logging.basicConfig(level=logging.WARNING)
+
+    daemon = start_dbus_daemon()
+    fakePlayer = start_fake_player()
+    try:
+        results = run_benchmark(args.iterations)
+    finally:
+        fakePlayer.terminate()
+        daemon.terminate()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
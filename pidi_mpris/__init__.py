@@ -1,8 +1,21 @@
+# The public classes are imported on first use, so running pidi_mpris.main
+# does not import PIL, D-Bus and GLib before the configuration is read.
+_exports = {
+    'Player': '.player',
+    'MPRIS': '.mpris',
+    'Display': '.display',
+    'Buttons': '.buttons',
+    'Button': '.buttons'
+}
 
-from .player import Player
-from .mpris import MPRIS
-from .display import Display
-from .buttons import (
-    Buttons,
-    Button
-)
+
+def __getattr__(name):
+    if name in _exports:
+        import importlib
+        return getattr(importlib.import_module(_exports[name], __name__), name)
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_exports.keys()))
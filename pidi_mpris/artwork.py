@@ -0,0 +1,380 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import hashlib
+import http.client
+import json
+import logging
+import os
+import queue
+import threading
+from time import time
+from urllib.parse import urljoin, urlsplit
+
+from PIL import Image
+
+from . import metrics
+from .cache import LRUCache
+
+
+log = logging.getLogger(__name__)
+
+
+MAX_REDIRECTS = 3
+
+
+def art_url_to_path(artUrl):
+    '''
+    Returns the local file path for a "file://" artwork URL or None.
+    '''
+    if artUrl.startswith('file://'):
+        return artUrl[len('file://'):]
+    return None
+
+
+def is_http_url(artUrl):
+    return artUrl.startswith('http://') or artUrl.startswith('https://')
+
+
+def file_key(path):
+    '''
+    Returns a cache key for a file that changes when the file is replaced.
+    '''
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+class ArtworkCache:
+    '''
+    In-memory cache of artwork, already resized and converted to the wire
+    format of the display. Entries are keyed by file path, modification time
+    and size, so a replaced file is decoded again.
+    '''
+
+    def __init__(self, display, maxBytes, workers):
+        self._display = display
+        self._size = (display.width, display.height)
+        self._cache = LRUCache(maxBytes, name='artwork')
+        self._workers = workers
+
+        # Artwork files to decode in the background, only the latest
+        # prefetch request is kept. One worker task at a time decodes them.
+        self._prefetch = []
+        self._prefetchLock = threading.Lock()
+        self._prefetching = False
+
+    def get(self, imageFile):
+        key = self._key(imageFile)
+
+        image = self._cache.get(key)
+        if image is None:
+            image = self._load(imageFile)
+            self._cache.put(key, image, image.nbytes)
+        else:
+            log.debug('Artwork cache hit %s', imageFile)
+        return image
+
+    def cached(self, imageFile):
+        '''
+        Returns the artwork if it is in the cache, otherwise (or if the file
+        does not exist) None.
+        '''
+        try:
+            key = self._key(imageFile)
+        except OSError:
+            return None
+        return self._cache.get(key) if key in self._cache else None
+
+    def prefetch(self, imageFiles):
+        '''
+        Decodes the given artwork files in the worker pool, so a later call
+        to get() is served from the cache.
+        '''
+        with self._prefetchLock:
+            self._prefetch = list(imageFiles)
+            if self._prefetch and not self._prefetching:
+                self._prefetching = True
+                self._workers.submit(self._prefetchArtwork)
+
+    def _prefetchArtwork(self):
+        while True:
+            with self._prefetchLock:
+                if not self._prefetch:
+                    self._prefetching = False
+                    return
+                imageFile = self._prefetch.pop(0)
+
+            try:
+                key = self._key(imageFile)
+                if key not in self._cache:
+                    log.debug('Prefetching artwork %s', imageFile)
+                    image = self._load(imageFile)
+                    self._cache.put(key, image, image.nbytes)
+            except OSError as e:
+                log.debug('Failed to prefetch artwork %s: %s', imageFile, e)
+
+    def stats(self):
+        return self._cache.stats()
+
+    def _key(self, imageFile):
+        return file_key(imageFile)
+
+    @metrics.histogram('pidi_artwork_decode_seconds', 'Time to decode an artwork file for the display').time()
+    def _load(self, imageFile):
+        log.debug('Decoding artwork %s', imageFile)
+
+        with Image.open(imageFile) as image:
+            # Let the decoder downscale (JPEG draft mode) before resizing
+            image.draft('RGB', self._size)
+            return self._display.toFrame(image.convert('RGB').resize(self._size))
+
+
+class DiskCache:
+    '''
+    Content-addressed on-disk cache for downloaded artwork. Files are stored
+    by the SHA-256 of their content, an index maps URLs to files and their
+    last use. The least recently used files are removed if the cache exceeds
+    its size limit. The cache persists across restarts.
+
+    Files are never modified once stored, so their modification time can be
+    used as part of the in-memory cache keys (see file_key()).
+    '''
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, directory, maxBytes):
+        self._directory = directory
+        self._maxBytes = maxBytes
+        self._lock = threading.Lock()
+
+        # The directory is created on the first download (http artwork is
+        # optional, it may not be writable)
+        self._index = self._loadIndex()
+
+    def path(self, url):
+        '''
+        Returns the path of the cached file for the URL or None.
+        '''
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None:
+                return None
+
+            path = self._blobPath(entry[0])
+            if not os.path.exists(path):
+                del self._index[url]
+                return None
+
+            # Saved with the next download, lookups do not write to disk
+            entry[1] = time()
+            return path
+
+    def store(self, url, data):
+        '''
+        Stores the data for the URL and returns the path of the file. Returns
+        None if the data is larger than the cache.
+        '''
+        if len(data) > self._maxBytes:
+            log.debug('Not caching %s (size %s exceeds limit %s)',
+                      url, len(data), self._maxBytes)
+            return None
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blobPath(digest)
+
+        with self._lock:
+            os.makedirs(self._directory, exist_ok=True)
+            if not os.path.exists(path):
+                tmpPath = path + '.tmp'
+                with open(tmpPath, 'wb') as f:
+                    f.write(data)
+                os.replace(tmpPath, path)
+
+            self._index[url] = [digest, time()]
+            self._evict()
+            self._saveIndex()
+        return path
+
+    def _blobPath(self, digest):
+        return os.path.join(self._directory, digest)
+
+    def _loadIndex(self):
+        try:
+            with open(os.path.join(self._directory, DiskCache.INDEX_FILE)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        # Each entry is [digest, last use]
+        entries = {}
+        for url, entry in index.items():
+            if isinstance(entry, str):
+                entry = [entry, 0]
+            if os.path.exists(self._blobPath(entry[0])):
+                entries[url] = entry
+        return entries
+
+    def _saveIndex(self):
+        indexPath = os.path.join(self._directory, DiskCache.INDEX_FILE)
+        with open(indexPath + '.tmp', 'w') as f:
+            json.dump(self._index, f)
+        os.replace(indexPath + '.tmp', indexPath)
+
+    def _evict(self):
+        # A file shared by several URLs was last used by any of them
+        lastUse = {}
+        for digest, used in self._index.values():
+            lastUse[digest] = max(used, lastUse.get(digest, 0))
+
+        blobs = []
+        for digest, used in lastUse.items():
+            try:
+                blobs.append((used, os.path.getsize(self._blobPath(digest)), digest))
+            except OSError:
+                pass
+
+        size = sum(blob[1] for blob in blobs)
+        for _used, blobSize, digest in sorted(blobs):
+            if size <= self._maxBytes:
+                break
+
+            log.debug('Removing %s from artwork disk cache', digest)
+            try:
+                os.remove(self._blobPath(digest))
+            except OSError:
+                pass
+            self._index = {url: entry for url, entry in self._index.items()
+                           if entry[0] != digest}
+            size -= blobSize
+
+
+class ArtworkDownloader:
+    '''
+    Downloads http(s) artwork URLs in the worker pool into a DiskCache (one
+    download at a time). Connections are kept open and reused for further
+    downloads from the same host.
+    '''
+
+    def __init__(self, diskCache, timeout, workers):
+        self._diskCache = diskCache
+        self._timeout = timeout
+        self._workers = workers
+        self._connections = {}
+        self._requests = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._downloading = False
+
+    def get(self, url, cb):
+        '''
+        Returns the path of the downloaded artwork, if it is in the disk cache.
+        Otherwise it is downloaded in the background and cb(url, path) is
+        called (from the worker thread) after the download completed
+        successfully and was stored in the disk cache.
+        '''
+        path = self._diskCache.path(url)
+        if path is None:
+            self._request(url, cb)
+        return path
+
+    def _request(self, url, cb):
+        with self._lock:
+            if url in self._pending:
+                return
+            self._pending.add(url)
+            self._requests.put((url, cb))
+
+            if not self._downloading:
+                self._downloading = True
+                self._workers.submit(self._download)
+
+    def _download(self):
+        while True:
+            with self._lock:
+                if self._requests.empty():
+                    self._downloading = False
+                    return
+                url, cb = self._requests.get()
+
+            path = self._diskCache.path(url)
+            if path is None:
+                try:
+                    path = self._diskCache.store(url, self._fetch(url))
+                    if path is None:
+                        log.warning(
+                            'Artwork %s is larger than the download cache', url)
+                    else:
+                        log.debug('Downloaded artwork %s', url)
+                except (OSError, http.client.HTTPException) as e:
+                    log.warning('Failed to download artwork %s: %s', url, e)
+
+            with self._lock:
+                self._pending.discard(url)
+
+            if path and cb:
+                cb(url, path)
+
+    def _fetch(self, url):
+        for _redirect in range(MAX_REDIRECTS + 1):
+            response = self._get(url)
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                url = urljoin(url, response.getheader('Location'))
+                continue
+
+            data = response.read()
+            if response.status != 200:
+                raise http.client.HTTPException(
+                    'HTTP status {}'.format(response.status))
+            return data
+
+        raise http.client.HTTPException('Too many redirects')
+
+    def _get(self, url):
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        key = (parts.scheme, parts.netloc)
+        for retry in (False, True):
+            connection = self._connections.get(key)
+            if connection is None:
+                if parts.scheme == 'https':
+                    connection = http.client.HTTPSConnection(
+                        parts.netloc, timeout=self._timeout)
+                else:
+                    connection = http.client.HTTPConnection(
+                        parts.netloc, timeout=self._timeout)
+                self._connections[key] = connection
+
+            try:
+                connection.request('GET', path)
+                return connection.getresponse()
+            except (OSError, http.client.HTTPException):
+                # The server may have closed the kept-alive connection
+                connection.close()
+                del self._connections[key]
+                if retry:
+                    raise
@@ -23,10 +23,9 @@ SOFTWARE.
 '''
 
 from enum import Enum
+from gi.repository import GLib
 import logging
-from time import sleep, time
-
-import RPi.GPIO as GPIO
+from time import monotonic
 
 
 log = logging.getLogger(__name__)
@@ -46,27 +45,81 @@ class Button(Enum):
         return obj
 
 
+def create_gpio(backend):
+    if backend == 'gpio':
+        import RPi.GPIO as GPIO
+        return GPIO
+    elif backend == 'virtual':
+        from .virtual import VirtualGPIO
+        return VirtualGPIO()
+
+    raise ValueError('Invalid buttons backend: {}'.format(backend))
+
+
+class Press:
+    def __init__(self, button, pressTime):
+        self.button = button
+        self.pressTime = pressTime
+        self.timer = None
+        # Set if a handler returned False or the button became part of a chord
+        self.cancelled = False
+
+    def secondsPressed(self):
+        return monotonic() - self.pressTime
+
+
 class Buttons:
+    '''
+    Detects presses, long presses and releases of the buttons from both
+    signal edges. Long presses are timed with GLib timeout sources (first
+    after longPressTime seconds, then every repeatInterval seconds). Pressing
+    a button while others are held emits a chord event with all held buttons.
+
+    The GPIO callback only reads the level and passes the edge to the GLib
+    main loop, all handlers are called on the main loop.
+    '''
+
+    def __init__(self, conf):
+        self._conf = conf['Buttons']
+        self.gpio = create_gpio(self._conf['backend'])
+        self.bouncetimeInSeconds = int(self._conf['bouncetime']) / 1000
+        self.longPressTime = float(self._conf['long_press'])
+        self.repeatInterval = float(self._conf['repeat_interval'])
 
-    def __init__(self):
-        self.buttonHandler = None
-        self.bouncetime = 300
-        self.bouncetimeInSeconds = self.bouncetime / 1000
-        self.lastEventTime = 0
+        self.onPressed = None
+        self.onLongPress = None
+        self.onReleased = None
+        self.onChord = None
+
+        self._pressed = {}
+        self._lastEdgeTime = {}
+        self._settleTimers = {}
 
         # Set up RPi.GPIO with the "BCM" numbering scheme
-        GPIO.setmode(GPIO.BCM)
+        self.gpio.setmode(self.gpio.BCM)
 
         # Buttons connect to ground when pressed, so we should set them up
         # with a "PULL UP", which weakly pulls the input signal to 3.3V.
         for button in Button:
-            GPIO.setup(button.value, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-            GPIO.add_event_detect(
-                button.value, GPIO.FALLING, self.onButtonPressed, bouncetime=self.bouncetime)
+            self.gpio.setup(button.value, self.gpio.IN,
+                            pull_up_down=self.gpio.PUD_UP)
+            self.gpio.add_event_detect(
+                button.value, self.gpio.BOTH, self.onEdge)
+
+        if self._conf['backend'] == 'virtual' and self._conf['virtual_script']:
+            self.gpio.play(self._conf['virtual_script'])
 
     def cleanup(self):
         for button in Button:
-            GPIO.cleanup(button.value)
+            self.gpio.cleanup(button.value)
+
+        for press in self._pressed.values():
+            self._cancelTimer(press)
+        self._pressed = {}
+
+        for timer in self._settleTimers.values():
+            GLib.source_remove(timer)
+        self._settleTimers = {}
 
     def onPressedHandler(self, cb):
         self.onPressed = cb
@@ -77,40 +130,128 @@ class Buttons:
     def onReleasedHandler(self, cb):
         self.onReleased = cb
 
-    def onButtonPressed(self, pin):
-        if time() - self.lastEventTime < self.bouncetimeInSeconds:
-            log.debug('Ignoring button press on %s (bouncetime)', pin)
-            return
+    def onChordHandler(self, cb):
+        self.onChord = cb
+
+    def onEdge(self, pin):
+        # Called from the GPIO thread
+        now = monotonic()
+        pressed = self.gpio.input(pin) == self.gpio.LOW
+        GLib.idle_add(self._onEdge, Button(pin), pressed, now)
+
+    def _onEdge(self, button, pressed, now):
+        if pressed == (button in self._pressed):
+            # No state change, e. g. a bouncing contact
+            return False
+
+        elapsed = now - self._lastEdgeTime.get(button, 0)
+        if elapsed < self.bouncetimeInSeconds:
+            log.debug('Ignoring edge on %s (bouncetime)', button)
+
+            # The level is read again after the bouncetime, so a release
+            # shortly after the press does not leave the button pressed
+            if button not in self._settleTimers:
+                self._settleTimers[button] = GLib.timeout_add(
+                    int((self.bouncetimeInSeconds - elapsed) * 1000) + 1, self._onSettled, button)
+            return False
 
-        button = Button(pin)
+        self._setState(button, pressed, now)
+
+        # Remove the GLib idle source
+        return False
+
+    def _onSettled(self, button):
+        del self._settleTimers[button]
+
+        pressed = self.gpio.input(button.value) == self.gpio.LOW
+        if pressed != (button in self._pressed):
+            log.debug('Button %s changed during bouncetime', button)
+            self._setState(button, pressed, monotonic())
+
+        # Remove the GLib timeout source
+        return False
+
+    def _setState(self, button, pressed, now):
+        self._lastEdgeTime[button] = now
+
+        if pressed:
+            self._press(button, now)
+        else:
+            self._release(button)
+
+    def _press(self, button, now):
         log.debug('Button pressed %s', button)
 
-        self.lastEventTime = time()
+        press = Press(button, now)
+        self._pressed[button] = press
+
+        if len(self._pressed) > 1:
+            # Held buttons form a chord, their single button events end here
+            for held in self._pressed.values():
+                held.cancelled = True
+                self._cancelTimer(held)
+            self._dispatch('chord', frozenset(self._pressed.keys()))
+        else:
+            self._startTimer(press, self.longPressTime)
+            self._dispatch('pressed', press)
+
+    def _release(self, button):
+        press = self._pressed.pop(button)
+        self._cancelTimer(press)
 
-        if self.onPressed:
-            if not self.onPressed(button):
-                return
+        log.debug('Button released %s (%.1f s)',
+                  button, press.secondsPressed())
+        self._dispatch('released', press)
 
-        i = 0
-        secondsPressed = 0
-        while GPIO.input(pin) == GPIO.LOW:
-            self.lastEventTime = time()
-            sleep(0.1)
-            i = i + 1
+    def _startTimer(self, press, interval):
+        press.timer = GLib.timeout_add(
+            int(interval * 1000), self._onTimer, press)
 
-            if i % 10 == 0:
-                secondsPressed = secondsPressed + 1
-                log.debug('Button %ss pressed (iteration=%s)',
-                          secondsPressed, i)
+    def _cancelTimer(self, press):
+        if press.timer:
+            GLib.source_remove(press.timer)
+            press.timer = None
 
-                if self.onLongPress:
-                    log.debug('Long button pressed %s (%s s)',
-                              button, secondsPressed)
-                    if not self.onLongPress(button, secondsPressed):
-                        return
+    def _onTimer(self, press):
+        press.timer = None
+        if press.cancelled or self._pressed.get(press.button) is not press:
+            return False
 
-        self.lastEventTime = time()
+        self._startTimer(press, self.repeatInterval)
+        self._dispatch('longPress', press)
+
+        # Remove this GLib timeout source, the repeat has its own
+        return False
+
+    def _dispatch(self, eventType, arg):
+        try:
+            self._handle(eventType, arg)
+        except Exception:
+            log.exception('Failed to handle button event %s', eventType)
+
+    def _handle(self, eventType, arg):
+        if eventType == 'chord':
+            log.debug('Buttons pressed together %s', sorted(
+                button.label for button in arg))
+            if self.onChord:
+                self.onChord(arg)
+            return
+
+        press = arg
+        if eventType == 'pressed':
+            if self.onPressed and not self.onPressed(press.button):
+                press.cancelled = True
+            return
+
+        if press.cancelled:
+            return
 
-        log.debug('Button released %s (%s s)', button, secondsPressed)
-        if self.onReleased:
-            self.onReleased(button, secondsPressed)
+        secondsPressed = press.secondsPressed()
+        if eventType == 'longPress':
+            log.debug('Long button pressed %s (%.1f s)',
+                      press.button, secondsPressed)
+            if self.onLongPress and not self.onLongPress(press.button, secondsPressed):
+                press.cancelled = True
+        elif eventType == 'released':
+            if self.onReleased:
+                self.onReleased(press.button, secondsPressed)
@@ -0,0 +1,122 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from collections import OrderedDict
+import logging
+import threading
+
+from . import metrics
+
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache:
+    '''
+    Thread-safe least-recently-used cache limited by the summed size of its
+    entries (e. g. bytes of decoded image data).
+    '''
+
+    def __init__(self, maxSize, name='cache'):
+        self._maxSize = maxSize
+        self._name = name
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        metrics.gauge('pidi_cache_hits', 'Cache hits',
+                      lambda: self.hits, cache=name)
+        metrics.gauge('pidi_cache_misses', 'Cache misses',
+                      lambda: self.misses, cache=name)
+        metrics.gauge('pidi_cache_size', 'Size of the cached entries',
+                      lambda: self._size, cache=name)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def size(self):
+        return self._size
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=1):
+        if size > self._maxSize:
+            log.debug('Not caching %s in %s (size %s exceeds limit %s)',
+                      key, self._name, size, self._maxSize)
+            return False
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+
+            self._entries[key] = (value, size)
+            self._size += size
+
+            while self._size > self._maxSize:
+                evictedKey, (_value, evictedSize) = self._entries.popitem(
+                    last=False)
+                self._size -= evictedSize
+                self.evictions += 1
+                log.debug('Evicted %s from %s (%s bytes)',
+                          evictedKey, self._name, evictedSize)
+        return True
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'size': self._size,
+            'maxSize': self._maxSize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
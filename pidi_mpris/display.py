@@ -23,17 +23,282 @@ SOFTWARE.
 '''
 
 import logging
-import textwrap
+import threading
+import zlib
 
-from PIL import Image, ImageDraw
-import ST7789 as ST7789
+import numpy as np
+from PIL import Image, ImageDraw, ImageSequence
+
+from . import metrics
+from .cache import LRUCache
+from .glyphs import GlyphAtlas
 
 
 log = logging.getLogger(__name__)
 
+DEFAULT_FRAME_DURATION = 0.05
+
+TEXT_LAYOUT_CACHE_SIZE = 256
+ELLIPSIS = '\u2026'
+RGB565 = np.dtype('>u2')
+
+# Measured text layouts, keyed by (text, font, maxWidth, lineSpacing, maxLines)
+_textLayouts = LRUCache(TEXT_LAYOUT_CACHE_SIZE, name='text layouts')
+
+
+def decode_animation(imageFile, size):
+    '''
+    Decodes all frames of an (animated) image, resized to the given size.
+
+    Returns a list of (image, duration in seconds) tuples. Frames with at most
+    256 distinct colors are stored palette-indexed to save memory.
+    '''
+    frames = []
+    with Image.open(imageFile) as image:
+        for frame in ImageSequence.Iterator(image):
+            duration = DEFAULT_FRAME_DURATION
+            if 'duration' in frame.info:
+                duration = frame.info['duration'] / 1000
+
+            # Nearest neighbor scaling adds no colors, so frames of GIFs
+            # (at most 256 colors) stay palette-indexed
+            rgb = frame.convert('RGB')
+            if rgb.size != size:
+                rgb = rgb.resize(size, Image.NEAREST)
+            frames.append((to_palette_image(rgb), duration))
+
+    log.debug('Decoded %s frames from %s', len(frames), imageFile)
+    return frames
+
+
+def to_palette_image(image):
+    '''
+    Converts a RGB image to a palette-indexed image, if it uses no more than
+    256 distinct colors (without any loss). Otherwise returns the image as is.
+    '''
+    pixels = np.asarray(image, dtype=np.uint32)
+    keys = (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+    colors, indices = np.unique(keys, return_inverse=True)
+    if len(colors) > 256:
+        return image
+
+    palette = np.stack(
+        [(colors >> 16) & 0xFF, (colors >> 8) & 0xFF, colors & 0xFF], axis=1)
+    paletteImage = Image.fromarray(
+        indices.reshape(keys.shape).astype(np.uint8), 'P')
+    paletteImage.putpalette(palette.astype(np.uint8).tobytes())
+    return paletteImage
+
+
+def to_rgb565(image, rotation=0):
+    '''
+    Converts an image to a (rotated) array of big-endian RGB565 pixels, as
+    expected by the display controller.
+    '''
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    pixels = np.rot90(np.asarray(image, dtype=np.uint16), rotation // 90)
+    return _pack_rgb565(pixels)
+
+
+def _pack_rgb565(pixels):
+    rgb565 = ((pixels[..., 0] & 0xF8) << 8) | (
+        (pixels[..., 1] & 0xFC) << 3) | (pixels[..., 2] >> 3)
+    return rgb565.astype(RGB565, order='C')
+
+
+class PaletteFrame:
+    '''
+    Palette-indexed frame in display orientation. Uses half the memory of a
+    RGB565 frame and is expanded with a single table lookup.
+    '''
+
+    def __init__(self, indices, palette):
+        self.indices = indices
+        self.palette = palette
+        self.shape = indices.shape
+        self.nbytes = indices.nbytes + palette.nbytes
+
+    def toRGB565(self):
+        return self.palette[self.indices]
+
+
+def to_frame(image, rotation=0):
+    '''
+    Converts an image to a frame in the wire format of the display (see
+    Display.image()). Palette images become a PaletteFrame.
+    '''
+    if image.mode != 'P':
+        return to_rgb565(image, rotation)
+
+    indices = np.ascontiguousarray(
+        np.rot90(np.asarray(image), rotation // 90))
+    palette = np.zeros((256, 3), dtype=np.uint16)
+    colors = np.frombuffer(bytes(image.getpalette()), dtype=np.uint8)
+    colors = colors[:len(colors) // 3 * 3].reshape(-1, 3)
+    palette[:len(colors)] = colors
+    return PaletteFrame(indices, _pack_rgb565(palette))
+
+
+def as_rgb565(frame, width, height):
+    '''
+    Returns a frame (RGB565 ndarray, PaletteFrame or big-endian RGB565 bytes,
+    bytearray or memoryview in display orientation) as contiguous array of
+    shape (height, width) without copying, if possible.
+    '''
+    if isinstance(frame, PaletteFrame):
+        return frame.toRGB565()
+
+    if isinstance(frame, np.ndarray):
+        if frame.dtype == np.uint8:
+            frame = frame.view(RGB565)
+        elif frame.dtype != RGB565:
+            frame = frame.astype(RGB565)
+    else:
+        frame = np.frombuffer(frame, dtype=RGB565)
+
+    if frame.size != width * height:
+        raise ValueError('Invalid frame size: {} pixels (expected {}x{})'.format(
+            frame.size, width, height))
+    return np.ascontiguousarray(frame.reshape(height, width))
+
+
+def dirty_rects(previous, current, tileSize):
+    '''
+    Compares two frames tile by tile and returns the bounding rectangles
+    (x0, y0, x1, y1; exclusive end) of the changed regions.
+
+    Consecutive rows of changed tiles are merged into one rectangle.
+    '''
+    height, width = current.shape
+    rows = -(-height // tileSize)
+    cols = -(-width // tileSize)
+
+    changed = np.zeros((rows * tileSize, cols * tileSize), dtype=bool)
+    changed[:height, :width] = previous != current
+    tiles = changed.reshape(rows, tileSize, cols, tileSize).any(axis=(1, 3))
+
+    rects = []
+    dirtyRows = np.flatnonzero(tiles.any(axis=1))
+    if len(dirtyRows) == 0:
+        return rects
+
+    # Split dirty tile rows into bands of consecutive rows
+    bands = np.split(dirtyRows, np.flatnonzero(np.diff(dirtyRows) > 1) + 1)
+    for band in bands:
+        dirtyCols = np.flatnonzero(tiles[band[0]:band[-1] + 1].any(axis=0))
+        rects.append((int(dirtyCols[0]) * tileSize,
+                      int(band[0]) * tileSize,
+                      min((int(dirtyCols[-1]) + 1) * tileSize, width),
+                      min((int(band[-1]) + 1) * tileSize, height)))
+    return rects
+
+
+def fingerprint(image):
+    '''
+    Cheap fingerprint (CRC32 over the raw pixel data) to detect identical
+    frames.
+    '''
+    checksum = zlib.crc32(image.tobytes())
+    if image.mode == 'P':
+        checksum = zlib.crc32(bytes(image.getpalette()), checksum)
+    return (image.mode, image.size, checksum)
+
+
+def text_width(font, text):
+    if hasattr(font, 'getlength'):
+        return font.getlength(text)
+    return font.getsize(text)[0]
+
+
+def line_height(font):
+    if hasattr(font, 'getbbox'):
+        return font.getbbox('A')[3]
+    return font.getsize('A')[1]
+
+
+def layout_text(text, font, maxWidth=None, lineSpacing=4, maxLines=0):
+    '''
+    Wraps the text into lines that fit into maxWidth (measured with the given
+    font). If maxLines is set, the text is cut after maxLines and the last
+    line ends with an ellipsis.
+
+    Returns a tuple (lines, width, height). Layouts are cached, laying out
+    the same text again does not measure anything.
+    '''
+    key = (text, font, maxWidth, lineSpacing, maxLines)
+    layout = _textLayouts.get(key)
+    if layout is None:
+        layout = _layout_text(text, font, maxWidth, lineSpacing, maxLines)
+        _textLayouts.put(key, layout)
+    return layout
+
+
+def _layout_text(text, font, maxWidth, lineSpacing, maxLines):
+    if maxWidth:
+        lines = _wrap(text, font, maxWidth)
+    else:
+        lines = text.split('\n')
+
+    if maxLines > 0 and len(lines) > maxLines:
+        remainder = ' '.join(lines[maxLines - 1:])
+        lines = lines[:maxLines - 1]
+        lines.append(_ellipsize(remainder, font, maxWidth))
+
+    width = int(max(text_width(font, line) for line in lines) + 0.5)
+    height = len(lines) * line_height(font) + (len(lines) - 1) * lineSpacing
+    return lines, width, height
+
+
+def _wrap(text, font, maxWidth):
+    lines = []
+    for paragraph in text.split('\n'):
+        line = ''
+        for word in paragraph.split(' '):
+            candidate = line + ' ' + word if line else word
+            if text_width(font, candidate) <= maxWidth:
+                line = candidate
+                continue
+
+            if line:
+                lines.append(line)
+
+            # Break words that are too long for a line on their own
+            while len(word) > 1 and text_width(font, word) > maxWidth:
+                length = _fitting_length(word, font, maxWidth)
+                lines.append(word[:length])
+                word = word[length:]
+            line = word
+        lines.append(line)
+    return lines
+
+
+def _fitting_length(text, font, maxWidth, suffix=''):
+    '''
+    Returns the length of the longest prefix of the text that fits into
+    maxWidth (with the suffix appended), but at least 1.
+    '''
+    low, high = 1, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if text_width(font, text[:middle] + suffix) <= maxWidth:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _ellipsize(line, font, maxWidth):
+    if not maxWidth or text_width(font, line + ELLIPSIS) <= maxWidth:
+        return line + ELLIPSIS
+
+    length = _fitting_length(line, font, maxWidth, suffix=ELLIPSIS)
+    return line[:length].rstrip() + ELLIPSIS
+
 
 class Text:
-    def __init__(self, text, font, imageDraw, maxWidth=None, align='center', lineSpacing=4, margin=(4, 4), color=(255, 255, 255)):
+    def __init__(self, text, font, imageDraw, maxWidth=None, maxLines=0, align='center', lineSpacing=4, margin=(4, 4), color=(255, 255, 255), marquee=False):
         self.text = text
         self.font = font
         self.draw = imageDraw
@@ -42,39 +307,59 @@ class Text:
         self.margin = margin
         self.color = color
 
-        self.width, self.height = self._calcSize(maxWidth)
+        # A text wider than maxWidth in marquee mode stays on one line and is
+        # not drawn, it scrolls in a strip (see renderStrip())
+        self.scrolling = False
+        self.width, self.height = self._calcSize(maxWidth, maxLines, marquee)
 
-    def _calcSize(self, maxWidth):
+    def _calcSize(self, maxWidth, maxLines, marquee):
         if len(self.text) == 0:
             return 0, 0
 
-        width, height = self.draw.textsize(
-            self.text, self.font, spacing=self.lineSpacing)
+        if marquee and maxWidth:
+            lines, width, height = layout_text(
+                self.text.replace('\n', ' '), self.font, None, self.lineSpacing)
+            if width > maxWidth:
+                self.scrolling = True
+                self.text = lines[0]
+                return width, height + self.margin[0] + self.margin[1]
 
-        if maxWidth and maxWidth < width:
-            avgLetterWidth = width / len(self.text)
-            maxLetter = maxWidth // avgLetterWidth
-
-            wrapper = textwrap.TextWrapper(width=maxLetter)
-            self.text = wrapper.fill(self.text)
-
-            log.debug('Wrapped text "%s" (original size=%sx%s, avg letter width=%s, max letters=%s)',
-                      self.text, width, height, avgLetterWidth, maxLetter)
-            width, height = self.draw.textsize(
-                self.text, self.font, spacing=self.lineSpacing)
+        lines, width, height = layout_text(
+            self.text, self.font, maxWidth, self.lineSpacing, maxLines)
+        self.text = '\n'.join(lines)
 
         height = height + self.margin[0] + self.margin[1]
         log.debug('Text size: %sx%s (margin=%s)', width, height, self.margin)
         return width, height
 
     def drawText(self, x, y, width):
-        if len(self.text) == 0:
+        if len(self.text) == 0 or self.scrolling:
             return
 
         posX = x + self._posX(width)
         posY = y + self.margin[0]
-        self.draw.text((posX, posY), self.text, font=self.font,
-                       fill=self.color, align=self.align, spacing=self.lineSpacing)
+        self._draw(self.draw, posX, posY)
+
+    def renderStrip(self, gap, bgColor):
+        '''
+        Renders the text twice, gap pixels apart, into an image for
+        scrolling. Any window of the image that starts within the first
+        width + gap pixels shows a seamless part of the loop.
+        '''
+        period = self.width + gap
+        image = Image.new('RGB', (2 * period, self.height), color=bgColor)
+        draw = ImageDraw.Draw(image)
+        for x in (0, period):
+            self._draw(draw, x, self.margin[0])
+        return image, period
+
+    def _draw(self, imageDraw, x, y):
+        if isinstance(self.font, GlyphAtlas):
+            self.font.drawText(imageDraw, (x, y), self.text.split('\n'), self.color,
+                               align=self.align, spacing=self.lineSpacing, width=self.width)
+        else:
+            imageDraw.text((x, y), self.text, font=self.font,
+                           fill=self.color, align=self.align, spacing=self.lineSpacing)
 
     def _posX(self, width):
         if self.align == 'left':
@@ -94,6 +379,7 @@ class TextImage:
         self._margin = margin
 
         self._texts = []
+        self._regions = []
         self._innerWidth = self._width - (2 * self._margin)
         self._innerHeight = self._height - (2 * self._margin)
 
@@ -101,13 +387,34 @@ class TextImage:
             'RGB', (self._width, self._height), color=self._bgColor)
         self._draw = ImageDraw.Draw(self._image)
 
-    def add(self, text, font, color=(255, 255, 255)):
-        self._texts.append(Text(text, font, self._draw,
-                                maxWidth=self._innerWidth, color=color))
+    def layout(self, text, font, color=(255, 255, 255), maxLines=0, marquee=False):
+        '''
+        Returns the text laid out for this image, without adding it (see
+        addText()).
+        '''
+        return Text(text, font, self._draw, maxWidth=self._innerWidth,
+                    maxLines=maxLines, color=color, marquee=marquee)
+
+    def add(self, text, font, color=(255, 255, 255), maxLines=0, marquee=False):
+        self.addText(self.layout(text, font, color=color,
+                                 maxLines=maxLines, marquee=marquee))
+
+    def addText(self, txt):
+        self._texts.append(txt)
+
+    def marquees(self):
+        '''
+        Returns the scrolling texts with the region they scroll in (x, y,
+        width, height) from the last draw().
+        '''
+        return [(txt, region) for txt, region in self._regions if txt.scrolling]
 
     def reset(self):
         self._texts = []
 
+    def setBgColor(self, bgColor):
+        self._bgColor = bgColor
+
     def draw(self):
         self._draw.rectangle((0, 0, self._width, self._height), self._bgColor)
 
@@ -117,10 +424,15 @@ class TextImage:
         posY = self._posY(self._innerHeight, txtHeight,
                           self._valign) + self._margin
 
+        self._regions = []
         for txt in self._texts:
             txt.drawText(posX, posY, self._innerWidth)
+            self._regions.append(
+                (txt, (posX, posY, self._innerWidth, txt.height)))
             posY += txt.height
-        return self._image
+
+        # Frames are sent asynchronously, the image must not change afterwards
+        return self._image.copy()
 
     def _posY(self, height, txtHeight, valign):
         if valign == 'top':
@@ -131,23 +443,109 @@ class TextImage:
             return (height - txtHeight) // 2
 
 
-class Display:
+class ST7789Panel:
+    '''
+    The ST7789 display of the Pirate Audio board (using the ST7789 library).
+    '''
+
+    def __init__(self, rotation, spiSpeed):
+        import ST7789 as ST7789
 
-    def __init__(self):
         self.disp = ST7789.ST7789(
             port=0,
             cs=ST7789.BG_SPI_CS_FRONT,
             dc=9,
             backlight=13,  # 13 for Pirate Audio
-            spi_speed_hz=80 * 1000 * 1000)
+            rotation=rotation,
+            spi_speed_hz=spiSpeed)
 
         # Initialize display.
         self.disp.begin()
 
         self.width = self.disp.width
         self.height = self.disp.height
+        self.spiSpeed = spiSpeed
+
+    def setBacklight(self, value):
+        self.disp.set_backlight(value)
+
+    def setWindow(self, x0, y0, x1, y1):
+        self.disp.set_window(x0, y0, x1, y1)
+
+    def write(self, data):
+        self.disp.data(data)
+
+
+def create_panel(conf, rotation):
+    backend = conf['backend']
+    spiSpeed = int(conf['spi_speed'])
+
+    if backend == 'st7789':
+        return ST7789Panel(rotation, spiSpeed)
+    elif backend == 'spidev':
+        from .spi import SpidevPanel
+        return SpidevPanel(spiSpeed)
+    elif backend == 'virtual':
+        from .virtual import VirtualPanel
+        return VirtualPanel(spiSpeed, int(conf['virtual_frame_history']))
+
+    raise ValueError('Invalid display backend: {}'.format(backend))
+
+
+class Display:
+
+    def __init__(self, conf):
+        self._conf = conf['Display']
+        self._rotation = 90
+        self._tileSize = int(self._conf['tile_size'])
+        self._fullUpdateThreshold = float(
+            self._conf['full_update_threshold'])
+
+        self.panel = create_panel(self._conf, self._rotation)
+
+        self.width = self.panel.width
+        self.height = self.panel.height
         self.backLightOn = True
 
+        # Last frame sent to the display (RGB565, display orientation)
+        self._frame = None
+        self._fingerprint = None
+
+        self.framesSent = 0
+        self.framesSkipped = 0
+        self.bytesSaved = 0
+        self.framesDropped = 0
+
+        for name, description, fn in (
+                ('pidi_display_frames_sent', 'Frames sent to the display',
+                 lambda: self.framesSent),
+                ('pidi_display_frames_skipped', 'Frames not sent, because they were unchanged',
+                 lambda: self.framesSkipped),
+                ('pidi_display_frames_dropped', 'Frames replaced by a newer frame before they were sent',
+                 lambda: self.framesDropped),
+                ('pidi_display_bytes_saved', 'Bytes not sent for unchanged frames',
+                 lambda: self.bytesSaved)):
+            metrics.gauge(name, description, fn)
+
+        # Frames are sent by a single render thread. Only the latest frame
+        # is kept, a frame that was not sent yet is replaced by a newer one.
+        self._pending = None
+        self._running = True
+        self._condition = threading.Condition()
+
+        # Latest frame received while the backlight was off
+        self._deferred = None
+        self._backlightPending = False
+        self._thread = threading.Thread(
+            name='render', target=self._render, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+
     def status(self):
         return self.backLightOn
 
@@ -158,19 +556,149 @@ class Display:
         self.setBacklight(True)
 
     def setBacklight(self, value):
-        self.disp.set_backlight(value)
-        self.backLightOn = value
+        '''
+        While the backlight is off, frames are not sent (only the latest one
+        is kept). When it is turned on, the latest frame is sent first and the
+        render thread turns on the backlight afterwards.
+        '''
+        with self._condition:
+            self.backLightOn = value
+            if not value:
+                if self._pending is not None:
+                    self._deferred = self._pending
+                    self._pending = None
+            elif self._deferred is not None:
+                self._pending = self._deferred
+                self._deferred = None
+                self._backlightPending = True
+                self._condition.notify()
+                return
+
+            self.panel.setBacklight(value)
+
+    def stats(self):
+        return {
+            'framesSent': self.framesSent,
+            'framesSkipped': self.framesSkipped,
+            'bytesSaved': self.bytesSaved,
+            'framesDropped': self.framesDropped
+        }
+
+    def toFrame(self, image):
+        '''
+        Converts an image to the wire format of the display, e.g. to cache
+        frames that are shown repeatedly.
+        '''
+        return to_frame(image, self._rotation)
+
+    def paste(self, frame, image, xy):
+        '''
+        Copies the image into the RGB565 frame (from toFrame()) at the
+        position xy in image coordinates. Updates a region of a frame
+        without converting the whole frame. The image may be a RGB565 array
+        (not rotated), to paste without any conversion.
+        '''
+        if not isinstance(image, np.ndarray):
+            image = to_rgb565(image)
+
+        x, y = xy
+        height, width = image.shape
+        view = np.rot90(frame, -(self._rotation // 90))
+        view[y:y + height, x:x + width] = image
 
     def image(self, image):
-        self.disp.display(image)
-
-    def imageFile(self, imageFile):
-        image = Image.open(imageFile)
-
-        # Resize the image
-        image = image.resize((self.disp.width, self.disp.height))
-
-        # Draw the image on the display hardware.
-        log.debug('Drawing image %s', imageFile)
-
-        self.disp.display(image)
+        '''
+        Queues the image for the render thread and returns immediately. The
+        image must not be modified afterwards.
+
+        Besides PIL images, frames in the wire format of the display are
+        accepted (see toFrame()): RGB565 arrays, PaletteFrames, or big-endian
+        RGB565 bytes, bytearray or memoryview with the rotation applied.
+        They are sent without further conversion.
+        '''
+        with self._condition:
+            if not self.backLightOn:
+                if self._deferred is not None:
+                    self.framesDropped += 1
+                self._deferred = image
+                return
+
+            if self._pending is not None:
+                self.framesDropped += 1
+            self._pending = image
+            self._condition.notify()
+
+    def _render(self):
+        while True:
+            with self._condition:
+                while self._running and self._pending is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+
+                image = self._pending
+                self._pending = None
+                turnOn = self._backlightPending
+                self._backlightPending = False
+
+            try:
+                self._show(image)
+            except Exception:
+                log.exception('Failed to send frame to the display')
+
+            if turnOn:
+                with self._condition:
+                    if self.backLightOn:
+                        self.panel.setBacklight(True)
+
+    @metrics.histogram('pidi_display_frame_seconds', 'Time to convert and send a frame to the display').time()
+    def _show(self, image):
+        if isinstance(image, Image.Image):
+            imageFingerprint = fingerprint(image)
+            if self._frame is not None and imageFingerprint == self._fingerprint:
+                self._skip()
+                return
+            frame = to_rgb565(image, self._rotation)
+        else:
+            # Unchanged frames are found by comparing the frames below
+            imageFingerprint = None
+            frame = as_rgb565(image, self.panel.width, self.panel.height)
+
+        height, width = frame.shape
+
+        rects = None
+        if self._frame is not None and self._frame.shape == frame.shape:
+            rects = dirty_rects(self._frame, frame, self._tileSize)
+            if not rects:
+                self._fingerprint = imageFingerprint
+                self._skip()
+                return
+
+            changed = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in rects)
+            if changed > self._fullUpdateThreshold * width * height:
+                rects = None
+
+        if rects is None:
+            rects = [(0, 0, width, height)]
+
+        for x0, y0, x1, y1 in rects:
+            self._write(frame, x0, y0, x1, y1)
+
+        self._frame = frame
+        self._fingerprint = imageFingerprint
+        self.framesSent += 1
+
+    def _skip(self):
+        self.framesSkipped += 1
+        self.bytesSaved += self._frame.nbytes
+        log.debug('Skipped unchanged frame (skipped frames=%s, bytes saved=%s)',
+                  self.framesSkipped, self.bytesSaved)
+
+    @metrics.histogram('pidi_display_spi_write_seconds', 'Time to write a region of a frame to the display').time()
+    def _write(self, frame, x0, y0, x1, y1):
+        self.panel.setWindow(x0, y0, x1 - 1, y1 - 1)
+        if x0 == 0 and x1 == frame.shape[1] and frame.flags.c_contiguous:
+            # Full rows are contiguous in memory and are sent without a copy
+            self.panel.write(memoryview(frame[y0:y1]).cast('B'))
+        else:
+            self.panel.write(frame[y0:y1, x0:x1].tobytes())
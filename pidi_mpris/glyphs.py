@@ -0,0 +1,182 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import logging
+import threading
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+log = logging.getLogger(__name__)
+
+# Printable ASCII and Latin-1 characters
+LATIN_1 = ''.join(chr(c) for c in range(0x20, 0x7F)) + \
+    ''.join(chr(c) for c in range(0xA0, 0x100))
+
+_atlases = {}
+_atlasesLock = threading.Lock()
+
+
+def get_atlas(face, size):
+    '''
+    Returns the glyph atlas for the font face and size, atlases are shared
+    between all users of the same font.
+    '''
+    with _atlasesLock:
+        atlas = _atlases.get((face, size))
+        if atlas is None:
+            atlas = GlyphAtlas(ImageFont.truetype(face, size))
+            _atlases[(face, size)] = atlas
+        return atlas
+
+
+class Glyph:
+    def __init__(self, bitmap, offsetX, offsetY, advance):
+        # Alpha bitmap of the glyph (None for blank glyphs like space)
+        self.bitmap = bitmap
+        # Position of the bitmap relative to the pen position
+        self.offsetX = offsetX
+        self.offsetY = offsetY
+        self.advance = advance
+
+
+class GlyphAtlas:
+    '''
+    Rasterizes each glyph of a font once and composes text from the cached
+    glyph bitmaps. Glyphs are added lazily, warm() pre-renders a set of
+    characters.
+
+    Provides getlength() and getbbox() like PIL.ImageFont.FreeTypeFont, so an
+    atlas can be used for measuring text instead of the font.
+    '''
+
+    def __init__(self, font):
+        self.font = font
+        self._glyphs = {}
+        self._kerning = {}
+
+        ascent, descent = font.getmetrics()
+        self._padding = font.size
+        self._cellHeight = ascent + descent + 2 * self._padding
+
+    def warm(self, chars=LATIN_1):
+        for char in chars:
+            self.glyph(char)
+        log.debug('Glyph atlas %s: %s glyphs', self.font.getname(),
+                  len(self._glyphs))
+
+    def glyph(self, char):
+        glyph = self._glyphs.get(char)
+        if glyph is None:
+            glyph = self._rasterize(char)
+            self._glyphs[char] = glyph
+        return glyph
+
+    def kerning(self, left, right):
+        pair = left + right
+        kerning = self._kerning.get(pair)
+        if kerning is None:
+            kerning = self._length(pair) - self.glyph(left).advance - \
+                self.glyph(right).advance
+            self._kerning[pair] = kerning
+        return kerning
+
+    def getlength(self, text):
+        length = 0
+        previous = None
+        for char in text:
+            if previous is not None:
+                length += self.kerning(previous, char)
+            length += self.glyph(char).advance
+            previous = char
+        return length
+
+    def getbbox(self, text):
+        left = top = right = bottom = 0
+        for x, glyph in self._layout(text):
+            if glyph.bitmap is None:
+                continue
+            x0 = int(round(x)) + glyph.offsetX
+            left = min(left, x0)
+            top = min(top, glyph.offsetY)
+            right = max(right, x0 + glyph.bitmap.width)
+            bottom = max(bottom, glyph.offsetY + glyph.bitmap.height)
+        return left, top, right, bottom
+
+    def drawText(self, imageDraw, xy, lines, fill, align='left', spacing=4, width=None):
+        '''
+        Draws the lines of text by blitting the cached glyphs. Lines are
+        aligned within the given width (defaults to the widest line), like
+        PIL.ImageDraw.multiline_text does.
+        '''
+        x, y = xy
+        lineWidths = [self.getlength(line) for line in lines]
+        if width is None:
+            width = max(lineWidths, default=0)
+        lineAdvance = self.getbbox('A')[3] + spacing
+
+        for line, lineWidth in zip(lines, lineWidths):
+            if align == 'right':
+                lineX = x + width - lineWidth
+            elif align == 'center':
+                lineX = x + (width - lineWidth) / 2
+            else:
+                lineX = x
+
+            for penX, glyph in self._layout(line):
+                if glyph.bitmap is not None:
+                    imageDraw.bitmap(
+                        (int(round(lineX + penX)) + glyph.offsetX, y + glyph.offsetY), glyph.bitmap, fill=fill)
+            y += lineAdvance
+
+    def _layout(self, text):
+        penX = 0
+        previous = None
+        for char in text:
+            if previous is not None:
+                penX += self.kerning(previous, char)
+            glyph = self.glyph(char)
+            yield penX, glyph
+            penX += glyph.advance
+            previous = char
+
+    def _length(self, text):
+        if hasattr(self.font, 'getlength'):
+            return self.font.getlength(text)
+        return self.font.getsize(text)[0]
+
+    def _rasterize(self, char):
+        advance = self._length(char)
+
+        image = Image.new(
+            'L', (int(advance) + 2 * self._padding, self._cellHeight))
+        ImageDraw.Draw(image).text(
+            (self._padding, self._padding), char, font=self.font, fill=255)
+
+        bbox = image.getbbox()
+        if bbox is None:
+            return Glyph(None, 0, 0, advance)
+
+        return Glyph(image.crop(bbox), bbox[0] - self._padding,
+                     bbox[1] - self._padding, advance)
@@ -29,18 +29,44 @@ import configparser
 import logging
 import signal
 
-from gi.repository import GLib
-from dbus.mainloop.glib import DBusGMainLoop
-
-from .player import Player
+from .util import StartupProfile
 
 
 DEFAULT_CONF_FILE_PATH = '/etc/pidi-mpris.conf'
 
 INACTIVITY_TIMEOUT_IN_SEC = 60
+WORKER_THREADS = 2
+
+MPRIS_COALESCE_WINDOW_IN_MS = 50
+MPRIS_PLAYERS = ''
+MPRIS_FOLLOW_PLAYING = 'yes'
+MPRIS_CALL_TIMEOUT_IN_SEC = 2
+
+BUTTONS_BOUNCETIME_IN_MS = 50
+BUTTONS_LONG_PRESS_IN_SEC = 1
+BUTTONS_REPEAT_INTERVAL_IN_SEC = 1
+
+DISPLAY_SPI_SPEED_IN_HZ = 80 * 1000 * 1000
+DISPLAY_VIRTUAL_FRAME_HISTORY = 1000
+DISPLAY_TILE_SIZE = 16
+DISPLAY_FULL_UPDATE_THRESHOLD = 0.5
+
+METRICS_INTERVAL_IN_SEC = 15
 
 ARTWORK_FALLBACK_IMAGE = '/usr/share/pidi-mpris/images/namroud-gorguis-FZWivbri0Xk-unsplash.jpg'
+ARTWORK_CACHE_SIZE_IN_MB = 8
+ARTWORK_PREFETCH_DEPTH = 2
+ARTWORK_DOWNLOAD_CACHE_DIR = '/var/cache/pidi-mpris/artwork'
+ARTWORK_DOWNLOAD_CACHE_SIZE_IN_MB = 50
+ARTWORK_DOWNLOAD_TIMEOUT_IN_SEC = 10
+
+MARQUEE_FPS = 20
+MARQUEE_STEP_IN_PX = 2
+THEME_MIN_CONTRAST = 4.5
+PROGRESS_TICK_RATE = 4
+PROGRESS_BAR_BACKGROUND = '#404040'
 GIF_IMAGE = '/usr/share/pidi-mpris/images/deployrainbows.gif'
+GIF_FRAME_CACHE_SIZE_IN_MB = 16
 
 FONT_FACE_REGULAR = '/usr/share/pidi-mpris/fonts/OpenSans/OpenSans-Regular.ttf'
 FONT_FACE_BOLD = '/usr/share/pidi-mpris/fonts/OpenSans/OpenSans-Bold.ttf'
@@ -67,7 +93,7 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description='Pirate Audio MPRIS')
     parser.add_argument('-m',
                         '--mpris',
-                        help='DBus name of the MPRIS media player (has to start with "org.mpris.MediaPlayer2.")')
+                        help='DBus name of the MPRIS media player to control, other players are ignored (has to start with "org.mpris.MediaPlayer2.")')
     parser.add_argument('-c',
                         '--conf',
                         default=DEFAULT_CONF_FILE_PATH,
@@ -78,6 +104,15 @@ def parse_arguments():
     parser.add_argument('-f',
                         '--log-filename',
                         help='Log file (omit to log to std.err)')
+    parser.add_argument('--startup-profile',
+                        action='store_true',
+                        help='Print the time spent in each startup phase')
+    parser.add_argument('--measure-display',
+                        type=int,
+                        nargs='?',
+                        const=100,
+                        metavar='FRAMES',
+                        help='Send FRAMES (default 100) full frames to the display, print the achieved throughput and exit')
 
     return parser.parse_args()
 
@@ -102,9 +137,36 @@ def read_conf(args):
         'GENERAL': {
             'log_level': 'INFO',
             'log_filename': '',
-            'turn_off_when_inactive': INACTIVITY_TIMEOUT_IN_SEC},
+            'turn_off_when_inactive': INACTIVITY_TIMEOUT_IN_SEC,
+            'worker_threads': WORKER_THREADS},
+        'MPRIS': {
+            'coalesce_window': MPRIS_COALESCE_WINDOW_IN_MS,
+            'players': MPRIS_PLAYERS,
+            'follow_playing': MPRIS_FOLLOW_PLAYING,
+            'call_timeout': MPRIS_CALL_TIMEOUT_IN_SEC},
+        'Buttons': {
+            'backend': 'gpio',
+            'virtual_script': '',
+            'bouncetime': BUTTONS_BOUNCETIME_IN_MS,
+            'long_press': BUTTONS_LONG_PRESS_IN_SEC,
+            'repeat_interval': BUTTONS_REPEAT_INTERVAL_IN_SEC},
+        'Display': {
+            'backend': 'st7789',
+            'spi_speed': DISPLAY_SPI_SPEED_IN_HZ,
+            'virtual_frame_history': DISPLAY_VIRTUAL_FRAME_HISTORY,
+            'tile_size': DISPLAY_TILE_SIZE,
+            'full_update_threshold': DISPLAY_FULL_UPDATE_THRESHOLD},
+        'Metrics': {
+            'textfile': '',
+            'interval': METRICS_INTERVAL_IN_SEC,
+            'dbus': 'no'},
         'ArtworkScreen': {
-            'fallback_image': ARTWORK_FALLBACK_IMAGE
+            'fallback_image': ARTWORK_FALLBACK_IMAGE,
+            'cache_size': ARTWORK_CACHE_SIZE_IN_MB,
+            'prefetch_depth': ARTWORK_PREFETCH_DEPTH,
+            'download_cache_dir': ARTWORK_DOWNLOAD_CACHE_DIR,
+            'download_cache_size': ARTWORK_DOWNLOAD_CACHE_SIZE_IN_MB,
+            'download_timeout': ARTWORK_DOWNLOAD_TIMEOUT_IN_SEC
         },
         'NowPlayingInfoScreen': {
             'background': '${background_color}',
@@ -112,20 +174,51 @@ def read_conf(args):
             'line1_font_face': '${font_face_regular}',
             'line1_font_size': '${font_size_normal}',
             'line1_font_color': '${font_color_default}',
+            'line1_max_lines': 0,
+            'line1_marquee': 'no',
+            'line1_theme_color': 'default',
             'line2_text': '{title}',
             'line2_font_face': '${font_face_bold}',
             'line2_font_size': '${font_size_normal}',
             'line2_font_color': '${font_color_primary}',
+            'line2_max_lines': 0,
+            'line2_marquee': 'no',
+            'line2_theme_color': 'primary',
             'line3_text': '{album}',
             'line3_font_face': '${font_face_regular}',
             'line3_font_size': '${font_size_small}',
             'line3_font_color': '${font_color_muted}',
+            'line3_max_lines': 0,
+            'line3_marquee': 'no',
+            'line3_theme_color': 'muted',
             'line4_text': '',
             'line4_font_face': '${font_face_regular}',
             'line4_font_size': '${font_size_small}',
-            'line4_font_color': '${font_color_muted}'},
+            'line4_font_color': '${font_color_muted}',
+            'line4_max_lines': 0,
+            'line4_marquee': 'no',
+            'line4_theme_color': 'muted',
+            'marquee_fps': MARQUEE_FPS,
+            'marquee_step': MARQUEE_STEP_IN_PX,
+            'colors': 'fixed',
+            'min_contrast': THEME_MIN_CONTRAST},
+        'ProgressScreen': {
+            'background': '${background_color}',
+            'tick_rate': PROGRESS_TICK_RATE,
+            'bar_color': '${font_color_primary}',
+            'bar_background': PROGRESS_BAR_BACKGROUND,
+            'title_font_face': '${font_face_bold}',
+            'title_font_size': '${font_size_normal}',
+            'title_font_color': '${font_color_primary}',
+            'artist_font_face': '${font_face_regular}',
+            'artist_font_size': '${font_size_small}',
+            'artist_font_color': '${font_color_default}',
+            'time_font_face': '${font_face_regular}',
+            'time_font_size': '${font_size_small}',
+            'time_font_color': '${font_color_muted}'},
         'GifScreen': {
-            'image': GIF_IMAGE}
+            'image': GIF_IMAGE,
+            'frame_cache_size': GIF_FRAME_CACHE_SIZE_IN_MB}
     })
     conf.read(confFile)
 
@@ -148,15 +241,42 @@ def log_config(conf):
     return logging.getLogger(__name__)
 
 
+def measure_display(conf, frames):
+    from .display import create_panel
+    from .spi import measure_throughput
+
+    panel = create_panel(conf['Display'], 90)
+    panel.setBacklight(True)
+
+    result = measure_throughput(panel, frames)
+    print('Display backend: {}'.format(conf['Display']['backend']))
+    for key, value in result.items():
+        print('{}: {}'.format(key, value))
+
+
 def main():
     global mpris_player, display, buttons, loop, conf
 
-    DBusGMainLoop(set_as_default=True)
+    profile = StartupProfile()
+
+    with profile.phase('configuration'):
+        args = parse_arguments()
+        conf = read_conf(args)
+
+        log = log_config(conf)
 
-    args = parse_arguments()
-    conf = read_conf(args)
+    if args.measure_display:
+        measure_display(conf, args.measure_display)
+        return
 
-    log = log_config(conf)
+    # Deferred until the configuration is read
+    with profile.phase('imports'):
+        from gi.repository import GLib
+        from dbus.mainloop.glib import DBusGMainLoop
+
+        from .player import Player
+
+    DBusGMainLoop(set_as_default=True)
 
     log.debug('Configuration file: %s', args.conf)
     log.debug('Configuration: %s', {section: dict(
@@ -165,10 +285,13 @@ def main():
     log.debug('Initializing MPRIS player %s', args.mpris)
 
     player = Player(args.mpris, conf)
-    player.init()
+    player.init(profile)
 
     print('Init complete, press Ctrl+C to exit')
 
+    if args.startup_profile:
+        print(profile.report())
+
     signal.signal(signal.SIGINT, end)
 
     try:
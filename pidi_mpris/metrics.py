@@ -0,0 +1,238 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from bisect import bisect_left
+import functools
+import logging
+import os
+import threading
+from time import perf_counter
+
+
+log = logging.getLogger(__name__)
+
+# Latency buckets (in seconds) from 100 us to 10 s
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DBUS_BUS_NAME = 'org.pidi_mpris'
+DBUS_OBJECT_PATH = '/org/pidi_mpris/Metrics'
+DBUS_INTERFACE = 'org.pidi_mpris.Metrics'
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in items) + '}'
+
+
+class Counter:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name + _format_labels(self.labels), self.value
+
+
+class Gauge:
+    '''
+    Gauge whose value is read from a function when the metrics are collected.
+    '''
+
+    def __init__(self, name, labels, fn):
+        self.name = name
+        self.labels = labels
+        self.fn = fn
+
+    def samples(self):
+        yield self.name + _format_labels(self.labels), self.fn()
+
+
+class Histogram:
+    '''
+    Histogram with fixed buckets. Recording a value only increments a bucket
+    counter, the cumulative counts are computed when collected.
+    '''
+
+    def __init__(self, name, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return Timer(self)
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield self.name + '_bucket' + _format_labels(self.labels, {'le': bound}), cumulative
+        yield self.name + '_sum' + _format_labels(self.labels), self.sum
+        yield self.name + '_count' + _format_labels(self.labels), self.count
+
+
+class Timer:
+    '''
+    Context manager (and decorator) recording the elapsed time in a histogram.
+    '''
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *_args):
+        self._histogram.observe(perf_counter() - self._start)
+
+    def __call__(self, fn):
+        histogram = self._histogram
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start)
+        return timed
+
+
+class Registry:
+    '''
+    Collection of all metrics. Metrics are only formatted when read, so
+    recording them costs a few increments.
+    '''
+
+    def __init__(self):
+        self._metrics = {}
+        self._help = {}
+        self._types = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, description, **labels):
+        return self._get(Counter, 'counter', name, description, labels)
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(lambda name, labels: Histogram(name, labels, buckets),
+                         'histogram', name, description, labels)
+
+    def gauge(self, name, description, fn, **labels):
+        '''
+        Registering a gauge again (e. g. by a new instance of the class that
+        registered it) replaces its function, so it reports the latest
+        instance and does not keep the previous one alive.
+        '''
+        gauge = self._get(lambda name, labels: Gauge(name, labels, fn),
+                          'gauge', name, description, labels)
+        gauge.fn = fn
+        return gauge
+
+    def _get(self, factory, metricType, name, description, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = factory(name, labels)
+                self._metrics[key] = metric
+                self._help[name] = description
+                self._types[name] = metricType
+            return metric
+
+    def collect(self):
+        '''
+        Returns all metrics in the Prometheus text format.
+        '''
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+
+        lines = []
+        previousName = None
+        for (name, _labels), metric in metrics:
+            if name != previousName:
+                lines.append('# HELP {} {}'.format(name, self._help[name]))
+                lines.append('# TYPE {} {}'.format(name, self._types[name]))
+                previousName = name
+            for sample, value in metric.samples():
+                lines.append('{} {}'.format(sample, value))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, description, **labels):
+    return REGISTRY.counter(name, description, **labels)
+
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS, **labels):
+    return REGISTRY.histogram(name, description, buckets, **labels)
+
+
+def gauge(name, description, fn, **labels):
+    return REGISTRY.gauge(name, description, fn, **labels)
+
+
+def write_textfile(path, registry=REGISTRY):
+    '''
+    Writes the metrics for the Prometheus node exporter textfile collector.
+    '''
+    tmpPath = path + '.tmp'
+    try:
+        with open(tmpPath, 'w') as f:
+            f.write(registry.collect())
+        os.replace(tmpPath, path)
+    except OSError as e:
+        log.warning('Failed to write metrics to %s: %s', path, e)
+
+
+def export_dbus(bus, registry=REGISTRY):
+    '''
+    Exports the metrics as D-Bus object (method GetMetrics returns the
+    metrics in the Prometheus text format).
+    '''
+    import dbus.service
+
+    class MetricsObject(dbus.service.Object):
+        @dbus.service.method(DBUS_INTERFACE, out_signature='s')
+        def GetMetrics(self):
+            return registry.collect()
+
+    busName = dbus.service.BusName(DBUS_BUS_NAME, bus)
+    return busName, MetricsObject(bus, DBUS_OBJECT_PATH)
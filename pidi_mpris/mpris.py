@@ -24,7 +24,11 @@ SOFTWARE.
 
 import dbus
 from enum import Enum
+from gi.repository import GLib
 import logging
+from time import monotonic
+
+from . import metrics
 
 
 log = logging.getLogger(__name__)
@@ -34,24 +38,85 @@ class PlaybackStatus(Enum):
     PLAYING = 'Playing'
     PAUSED = 'Paused'
     STOPPED = 'Stopped'
-    UNKNOWN = 'Unkown'
+    UNKNOWN = 'Unknown'
+
+
+class MediaPlayer:
+    '''
+    Cached state of one MPRIS media player on the bus. The properties are kept
+    up to date with the PropertiesChanged signals of the player.
+    '''
+
+    def __init__(self, busName, owner, proxy):
+        self.busName = busName
+        self.owner = owner
+        self.proxy = proxy
+        self.interface = dbus.Interface(proxy, MPRIS.INTERFACE_PLAYER)
+        self.trackList = None
+        self.signalMatches = []
+
+        self.identity = ''
+        self.metadata = {}
+        self.status = PlaybackStatus.UNKNOWN
+
+        # Properties were received (GetAll) and the time the player last
+        # started playing (monotonic clock)
+        self.ready = False
+        self.lastPlaying = 0
+
+        # Playback position (in microseconds) at positionTime (monotonic
+        # clock), it advances with the playback rate while playing
+        self.position = 0
+        self.positionTime = monotonic()
+        self.rate = 1.0
+
+    def currentPosition(self):
+        position = self.position
+        if self.status == PlaybackStatus.PLAYING:
+            position += (monotonic() - self.positionTime) * self.rate * 1e6
+
+        length = self.metadata.get('mpris:length', 0)
+        if length > 0:
+            position = min(position, length)
+        return int(max(position, 0))
+
+    def setPosition(self, position):
+        self.position = position
+        self.positionTime = monotonic()
+
+    def __repr__(self):
+        return self.busName
 
 
 class MPRIS:
+    '''
+    Tracks all MPRIS media players on the bus. Commands and getters refer to
+    the active player, which is picked by policy: a player that starts
+    playing becomes active (if followPlaying is set). Otherwise playing
+    players are preferred over paused ones, then players are ranked by the
+    priority list (bus names, "org.mpris.MediaPlayer2." may be omitted).
+
+    If bus_name is given, only this player is tracked.
+    '''
+
     BUS_NAME_PREFIX = 'org.mpris.MediaPlayer2.'
     OBJECT_PATH = '/org/mpris/MediaPlayer2'
+    INTERFACE_ROOT = 'org.mpris.MediaPlayer2'
     INTERFACE_PLAYER = 'org.mpris.MediaPlayer2.Player'
+    INTERFACE_TRACKLIST = 'org.mpris.MediaPlayer2.TrackList'
     INTERFACE_PROPERTIES = 'org.freedesktop.DBus.Properties'
 
-    def __init__(self, bus_name):
-        self.bus_name = bus_name
-        self.connectedBus = None
-        self.mpris = None
-        self.properties = None
-        self.interface = None
+    def __init__(self, bus_name, coalesceWindow=0, priority=(), followPlaying=True, callTimeout=2):
+        self.bus_name = to_bus_name(bus_name) if bus_name else None
+        self.coalesceWindow = coalesceWindow
+        self.callTimeout = callTimeout
+        self.followPlaying = followPlaying
+        self.priority = [to_bus_name(name) for name in priority]
 
-        self.metadata = {}
-        self.status = PlaybackStatus.UNKNOWN
+        # Players by (well-known) bus name and bus names by unique name
+        self.players = {}
+        self._owners = {}
+        self.active = None
 
         self.bus = get_bus()
         self.busObject = self.bus.get_object("org.freedesktop.DBus",
@@ -59,112 +124,413 @@ class MPRIS:
         self.busObject.connect_to_signal(
             "NameOwnerChanged", self.nameOwnerChanged)
 
-        self.updateHandler = None
-
-        availablePlayer = self._find_mpris_bus_name(self.bus_name)
-        if availablePlayer:
-            self.connect(availablePlayer)
+        # One signal match for the property changes of all players
+        self.bus.add_signal_receiver(self.propertiesChanged, signal_name='PropertiesChanged',
+                                     dbus_interface=MPRIS.INTERFACE_PROPERTIES,
+                                     path=MPRIS.OBJECT_PATH, sender_keyword='sender')
+        self.bus.add_signal_receiver(self.seeked, signal_name='Seeked',
+                                     dbus_interface=MPRIS.INTERFACE_PLAYER,
+                                     path=MPRIS.OBJECT_PATH, sender_keyword='sender')
 
-    def nameOwnerChanged(self, name, _oldOwner, newOwner):
-        if not name.startswith(MPRIS.BUS_NAME_PREFIX):
+        self.updateHandler = None
+        self.prefetchHandler = None
+        self.prefetchDepth = 0
+
+        # State last delivered to the update handler and the pending timeout
+        # for coalescing bursts of property changes
+        self._deliveredPlayer = None
+        self._deliveredMetadata = {}
+        self._deliveredStatus = PlaybackStatus.UNKNOWN
+        self._updateSource = None
+
+        # Until the players found at startup sent their properties, the
+        # active player is chosen by policy on each reply
+        availablePlayers = self._find_available_players()
+        log.debug('Available MPRIS players: %s', availablePlayers)
+
+        self._startup = set(availablePlayers)
+        for busName in availablePlayers:
+            self._addPlayer(busName, self.bus.get_name_owner(busName))
+
+    @property
+    def metadata(self):
+        return self.active.metadata if self.active else {}
+
+    @property
+    def status(self):
+        return self.active.status if self.active else PlaybackStatus.UNKNOWN
+
+    @property
+    def connectedBus(self):
+        return self.active.busName if self.active else None
+
+    def nameOwnerChanged(self, name, oldOwner, newOwner):
+        if not self._busNameMatches(name):
             return
 
-        log.debug('NameOwnerChange: %s/%s/%s', name, _oldOwner, newOwner)
+        log.debug('NameOwnerChange: %s/%s/%s', name, oldOwner, newOwner)
 
-        if self.connectedBus:
-            if not newOwner and name == self.connectedBus:
-                self.disconnect()
-        else:
-            if newOwner and self._busNameMatches(name):
-                self.connect(name)
+        if oldOwner and name in self.players:
+            self._removePlayer(name)
+        if newOwner:
+            self._addPlayer(name, newOwner)
 
     def _busNameMatches(self, name):
         return (self.bus_name and name == self.bus_name) or (not self.bus_name and name.startswith(MPRIS.BUS_NAME_PREFIX))
 
     def _find_available_players(self):
-        return list(filter(lambda service: service.startswith(MPRIS.BUS_NAME_PREFIX), self.bus.list_names()))
-
-    def _find_mpris_bus_name(self, arg_bus_name):
-        mpris_players = self._find_available_players()
+        return list(filter(self._busNameMatches, self.bus.list_names()))
+
+    def _addPlayer(self, busName, owner):
+        log.info('Tracking MPRIS player %s (%s)', busName, owner)
+
+        # The unique name does not need to be resolved
+        proxy = self.bus.get_object(owner, MPRIS.OBJECT_PATH, introspect=False)
+        player = MediaPlayer(busName, owner, proxy)
+        self.players[busName] = player
+        self._owners[owner] = busName
+
+        proxy.GetAll(MPRIS.INTERFACE_PLAYER, dbus_interface=MPRIS.INTERFACE_PROPERTIES,
+                     reply_handler=lambda properties: self._onPlayerProperties(
+                         player, properties),
+                     error_handler=lambda error: self._onPlayerError(player, error))
+        proxy.GetAll(MPRIS.INTERFACE_ROOT, dbus_interface=MPRIS.INTERFACE_PROPERTIES,
+                     reply_handler=lambda properties: self._onRootProperties(
+                         player, properties),
+                     error_handler=self._onDBusError)
+
+    def _removePlayer(self, busName):
+        log.info('MPRIS player %s disappeared', busName)
+
+        player = self.players.pop(busName)
+        self._owners.pop(player.owner, None)
+        self._startup.discard(busName)
+
+        for match in player.signalMatches:
+            match.remove()
+        player.signalMatches = []
+        player.trackList = None
+
+        if player is self.active:
+            self.active = None
+            self._setActive(self._choosePlayer())
+
+    def _onPlayerProperties(self, player, properties):
+        if self.players.get(player.busName) is not player:
+            return
 
-        log.debug('Available MPRIS players: %s', mpris_players)
+        player.metadata = properties.get('Metadata', {})
+        player.status = to_playback_status(
+            properties.get('PlaybackStatus'))
+        player.rate = float(properties.get('Rate', 1.0))
+        player.setPosition(int(properties.get('Position', 0)))
+        if player.status == PlaybackStatus.PLAYING:
+            player.lastPlaying = monotonic()
+        player.ready = True
+
+        log.debug('MPRIS player %s: %s', player.busName, player.status)
+
+        if self.active is None or player.busName in self._startup:
+            self._startup.discard(player.busName)
+            self._setActive(self._choosePlayer())
+        elif self.followPlaying and player.status == PlaybackStatus.PLAYING:
+            self._setActive(player)
+
+    def _onPlayerError(self, player, error):
+        log.warning('Failed to read the properties of MPRIS player %s: %s',
+                    player.busName, error)
+        self._startup.discard(player.busName)
+
+    def _onRootProperties(self, player, properties):
+        identity = str(properties.get('Identity', ''))
+        if identity != player.identity:
+            player.identity = identity
+            if player is self.active and self.updateHandler:
+                self.updateHandler({'Identity'})
+
+        if not properties.get('HasTrackList') or self.players.get(player.busName) is not player:
+            return
 
-        if arg_bus_name is None:
-            if len(mpris_players) > 0:
-                return mpris_players[0]
+        log.debug('MPRIS player %s supports the TrackList interface',
+                  player.busName)
+
+        player.trackList = dbus.Interface(
+            player.proxy, MPRIS.INTERFACE_TRACKLIST)
+        for signal in ('TrackListReplaced', 'TrackAdded', 'TrackRemoved'):
+            player.signalMatches.append(player.trackList.connect_to_signal(
+                signal, lambda *_args, player=player: self._onTrackListChanged(player)))
+
+        self._onTrackListChanged(player)
+
+    def _onTrackListChanged(self, player):
+        if player is self.active:
+            self._requestUpcomingTracks()
+
+    def _rank(self, player):
+        for index, name in enumerate(self.priority):
+            if player.busName == name or player.busName.startswith(name + '.'):
+                return index
+        return len(self.priority)
+
+    def _choosePlayer(self):
+        '''
+        Returns the preferred player: playing before paused, then by
+        priority, then the one that played most recently.
+        '''
+        candidates = [player for player in self.players.values()
+                      if player.ready]
+        if not candidates:
             return None
 
-        if arg_bus_name in mpris_players:
-            return arg_bus_name
-        return None
+        return min(candidates, key=lambda player: (
+            player.status != PlaybackStatus.PLAYING, self._rank(player), -player.lastPlaying, player.busName))
+
+    def _setActive(self, player):
+        if player is self.active:
+            return
+
+        log.info('Active MPRIS player: %s', player)
+        self.active = player
+
+        # The new player's state is delivered at once (from the cache)
+        if self._updateSource is not None:
+            GLib.source_remove(self._updateSource)
+        self._deliverUpdate()
+
+    def availablePlayers(self):
+        '''
+        Returns the bus names of the players with known state, in the order
+        they are cycled through.
+        '''
+        return [player.busName for player in sorted(
+            (player for player in self.players.values() if player.ready),
+            key=lambda player: (self._rank(player), player.busName))]
+
+    def selectPlayer(self, busName):
+        player = self.players.get(busName)
+        if player and player.ready:
+            self._setActive(player)
+
+    def cyclePlayer(self):
+        '''
+        Makes the next player active (see availablePlayers()).
+        '''
+        busNames = self.availablePlayers()
+        if not busNames:
+            return
 
-    def connect(self, busName):
-        log.info('Connecting to MPRIS player %s', busName)
+        index = 0
+        if self.connectedBus in busNames:
+            index = (busNames.index(self.connectedBus) + 1) % len(busNames)
+        self.selectPlayer(busNames[index])
 
-        self.mpris = self.bus.get_object(busName, MPRIS.OBJECT_PATH)
-        self.properties = dbus.Interface(
-            self.mpris, MPRIS.INTERFACE_PROPERTIES)
-        self.interface = dbus.Interface(self.mpris, MPRIS.INTERFACE_PLAYER)
-        self.metadata = self.mpris.Get(
-            MPRIS.INTERFACE_PLAYER, 'Metadata', dbus_interface=MPRIS.INTERFACE_PROPERTIES)
-        self.status = self.__toPlaybackStatus(self.mpris.Get(
-            MPRIS.INTERFACE_PLAYER, 'PlaybackStatus', dbus_interface=MPRIS.INTERFACE_PROPERTIES))
+    def _requestUpcomingTracks(self):
+        player = self.active
+        if not player or not player.trackList or not self.prefetchHandler or self.prefetchDepth <= 0:
+            return
 
-        self.properties.connect_to_signal(
-            'PropertiesChanged', self.propertiesChanged)
+        player.proxy.Get(MPRIS.INTERFACE_TRACKLIST, 'Tracks', dbus_interface=MPRIS.INTERFACE_PROPERTIES,
+                         reply_handler=lambda tracks: self._onTracks(
+                             player, tracks),
+                         error_handler=self._onDBusError)
 
-        self.connectedBus = busName
+    def _onTracks(self, player, tracks):
+        if player is not self.active or not player.trackList:
+            return
 
-    def disconnect(self):
-        log.info('Disconnecting from MPRIS player %s', self.bus_name)
+        trackId = player.metadata.get('mpris:trackid')
+        try:
+            index = tracks.index(trackId) + 1
+        except ValueError:
+            return
 
-        self.mpris = None
-        self.properties = None
-        self.interface = None
-        self.metadata = {}
+        upcoming = tracks[index:index + self.prefetchDepth]
+        if upcoming:
+            player.trackList.GetTracksMetadata(
+                upcoming, reply_handler=self._onUpcomingTracksMetadata, error_handler=self._onDBusError)
 
-        self.connectedBus = None
+    def _onUpcomingTracksMetadata(self, tracksMetadata):
+        artUrls = [metadata['mpris:artUrl']
+                   for metadata in tracksMetadata if 'mpris:artUrl' in metadata]
 
-    def propertiesChanged(self, *args):
-        if len(args) <= 1 or args[0] != MPRIS.INTERFACE_PLAYER:
+        log.debug('Upcoming artwork: %s', artUrls)
+        if artUrls and self.prefetchHandler:
+            self.prefetchHandler(artUrls)
+
+    def _onDBusError(self, error):
+        log.warning('DBUS call failed: %s', error)
+
+    @metrics.histogram('pidi_mpris_signal_seconds', 'Time to handle a D-Bus signal of the media player', signal='PropertiesChanged').time()
+    def propertiesChanged(self, interface, changedProperties, _invalidated, sender=None):
+        player = self.players.get(self._owners.get(sender))
+        if interface != MPRIS.INTERFACE_PLAYER or player is None or not player.ready:
             return
 
+        if 'Rate' in changedProperties:
+            player.setPosition(player.currentPosition())
+            player.rate = float(changedProperties['Rate'])
+
         hasChanges = False
-        if 'Metadata' in args[1]:
-            self.metadata = args[1]['Metadata']
+        requestPosition = False
+        if 'Metadata' in changedProperties:
+            metadata = changedProperties['Metadata']
+            if track_id(metadata) != track_id(player.metadata):
+                player.setPosition(0)
+                requestPosition = True
+            player.metadata = metadata
             hasChanges = True
 
-        if 'PlaybackStatus' in args[1]:
-            self.status = self.__toPlaybackStatus(args[1]['PlaybackStatus'])
+        if 'PlaybackStatus' in changedProperties:
+            status = to_playback_status(changedProperties['PlaybackStatus'])
+            if player.status != status:
+                player.setPosition(player.currentPosition())
+                requestPosition = True
+                if status == PlaybackStatus.PLAYING:
+                    player.lastPlaying = monotonic()
+            player.status = status
             hasChanges = True
 
-        log.debug('DBUS property changes %s (%s)', hasChanges, args[1])
-        if hasChanges and self.updateHandler:
-            self.updateHandler()
+        if requestPosition:
+            self._requestPosition(player)
+
+        log.debug('DBUS property changes of %s %s (%s)',
+                  player.busName, hasChanges, changedProperties)
+        if not hasChanges:
+            return
+
+        if player is not self.active:
+            if self.followPlaying and player.status == PlaybackStatus.PLAYING:
+                self._setActive(player)
+            return
+
+        if self.coalesceWindow <= 0:
+            self._deliverUpdate()
+        elif self._updateSource is None:
+            self._updateSource = GLib.timeout_add(
+                self.coalesceWindow, self._deliverUpdate)
+
+    def seeked(self, position, sender=None):
+        player = self.players.get(self._owners.get(sender))
+        if player is None:
+            return
+
+        log.debug('MPRIS player %s seeked to %s', player.busName, position)
+        self._onPosition(player, position)
+
+    def _requestPosition(self, player):
+        '''
+        Reads the exact position after events that may move it (track and
+        status changes), in between it is extrapolated.
+        '''
+        player.proxy.Get(MPRIS.INTERFACE_PLAYER, 'Position', dbus_interface=MPRIS.INTERFACE_PROPERTIES,
+                         reply_handler=lambda position: self._onPosition(
+                             player, position),
+                         error_handler=self._onDBusError)
+
+    def _onPosition(self, player, position):
+        player.setPosition(int(position))
+        if player is self.active and self.updateHandler:
+            self.updateHandler({'Position'})
+
+    @metrics.histogram('pidi_mpris_update_seconds', 'Time to handle a (coalesced) update of the media player').time()
+    def _deliverUpdate(self):
+        self._updateSource = None
+
+        changed = changed_fields(self._deliveredMetadata, self.metadata)
+        if self.status != self._deliveredStatus:
+            changed.add('PlaybackStatus')
+        if self.connectedBus != self._deliveredPlayer:
+            changed.add('Player')
+
+        self._deliveredPlayer = self.connectedBus
+        self._deliveredMetadata = self.metadata
+        self._deliveredStatus = self.status
+
+        log.debug('Changed fields: %s', changed)
+        if changed and self.updateHandler:
+            self.updateHandler(changed)
+
+        if changed & {'mpris:trackid', 'Player'}:
+            self._requestUpcomingTracks()
+
+        # Remove the GLib timeout source
+        return False
 
     def setUpdateHandler(self, cb):
+        '''
+        The handler is called with the set of changed metadata keys, plus
+        "PlaybackStatus", "Player" (the active player changed), "Identity"
+        (the name of the active player was read) and "Position" (the position
+        was read or the player seeked).
+        '''
         self.updateHandler = cb
 
+    def setPrefetchHandler(self, cb, depth):
+        '''
+        The handler is called with the artwork URLs of up to depth upcoming
+        tracks (if the player implements the TrackList interface).
+        '''
+        self.prefetchHandler = cb
+        self.prefetchDepth = depth
+        self._requestUpcomingTracks()
+
     def playbackStatus(self):
         return self.status
 
-    def __toPlaybackStatus(self, propValue):
-        try:
-            return PlaybackStatus(propValue)
-        except ValueError:
-            return PlaybackStatus.UNKNOWN
+    def position(self):
+        '''
+        Returns the playback position in microseconds, extrapolated from the
+        last known position and the playback rate.
+        '''
+        return self.active.currentPosition() if self.active else 0
+
+    def identity(self):
+        return self.active.identity if self.active else ''
 
     def playPause(self):
-        if self.interface:
-            self.interface.PlayPause()
+        self._call('PlayPause')
 
     def next(self):
-        if self.interface:
-            self.interface.Next()
+        self._call('Next')
 
     def previous(self):
-        if self.interface:
-            self.interface.Previous()
+        self._call('Previous')
+
+    def _call(self, method):
+        '''
+        Calls a method of the active player without waiting for the reply.
+        Calls are sent from the main loop in the order they were made, so
+        repeated presses are pipelined.
+        '''
+        if self.active:
+            GLib.idle_add(self._sendCall, self.active, method)
+
+    def _sendCall(self, player, method):
+        if self.players.get(player.busName) is not player:
+            return False
+
+        log.debug('Calling %s of MPRIS player %s', method, player.busName)
+
+        start = monotonic()
+        getattr(player.interface, method)(
+            reply_handler=lambda *_args: self._onCallReply(method, start),
+            error_handler=lambda error: self._onCallError(
+                player, method, start, error),
+            timeout=self.callTimeout)
+
+        # Remove the GLib idle source
+        return False
+
+    def _onCallReply(self, method, start):
+        metrics.histogram('pidi_mpris_call_seconds', 'Duration of D-Bus calls to the media player',
+                          method=method).observe(monotonic() - start)
+
+    def _onCallError(self, player, method, start, error):
+        self._onCallReply(method, start)
+        metrics.counter('pidi_mpris_call_errors', 'Failed or timed out D-Bus calls to the media player',
+                        method=method).inc()
+        log.warning('Call of %s failed (MPRIS player %s): %s',
+                    method, player.busName, error)
 
     def length(self):
         return self.metadata.get('mpris:length', 0)
@@ -184,6 +550,34 @@ class MPRIS:
     def title(self):
         return self.metadata.get('xesam:title', '')
 
+    def trackNumber(self):
+        return self.metadata.get('xesam:trackNumber', 0)
+
+
+def track_id(metadata):
+    # Not all players set a track id
+    return (metadata.get('mpris:trackid'), metadata.get('xesam:title'))
+
+
+def to_bus_name(name):
+    if name.startswith(MPRIS.BUS_NAME_PREFIX):
+        return name
+    return MPRIS.BUS_NAME_PREFIX + name
+
+
+def to_playback_status(propValue):
+    try:
+        return PlaybackStatus(propValue)
+    except ValueError:
+        return PlaybackStatus.UNKNOWN
+
+
+def changed_fields(old, new):
+    '''
+    Returns the set of metadata keys that differ between the two dicts.
+    '''
+    return {key for key in old.keys() | new.keys() if old.get(key) != new.get(key)}
+
 
 def get_bus():
     try:
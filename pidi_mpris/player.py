@@ -22,13 +22,26 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+from concurrent.futures import ThreadPoolExecutor
 import logging
-import threading
+from time import monotonic
 
+from gi.repository import GLib
+
+from . import metrics
+
+from .artwork import (
+    ArtworkCache,
+    ArtworkDownloader,
+    DiskCache,
+    art_url_to_path,
+    is_http_url
+)
 from .buttons import Buttons, Button
 from .display import Display
 from .mpris import MPRIS, PlaybackStatus
-from .screens import ArtworkScreen, NowPlayingInfoScreen, GifScreen
+from .screens import ArtworkScreen, NowPlayingInfoScreen, ProgressScreen, GifScreen
+from .util import StartupProfile
 
 
 log = logging.getLogger(__name__)
@@ -39,64 +52,154 @@ class Player:
         self._busName = busName
         self._conf = conf
 
-    def init(self):
+    def init(self, profile=None):
+        profile = profile or StartupProfile()
+
         self._timer = None
         self._interval = int(self._conf['GENERAL']['turn_off_when_inactive'])
         self._inactive = False
 
         log.debug('Turn display off after %ss of inactivity', self._interval)
 
-        self._mprisPlayer = MPRIS(self._busName)
-        self._mprisPlayer.setUpdateHandler(self._onPlayerUpdate)
+        # Everything else runs on the GLib main loop, blocking work (image
+        # decoding, downloads) goes to this pool. Frames are sent to the
+        # display by its render thread.
+        self._workers = ThreadPoolExecutor(
+            max_workers=int(self._conf['GENERAL']['worker_threads']), thread_name_prefix='worker')
 
-        log.debug('Initializing display')
+        # Display initialization (and splash frame) and font loading run in
+        # parallel to connecting to the media player
+        display = self._workers.submit(self._initDisplay, profile)
+        fonts = self._workers.submit(self._loadFonts, profile)
 
-        self._display = Display()
-        self._display.turnOn()
+        with profile.phase('mpris'):
+            mprisConf = self._conf['MPRIS']
+            self._mprisPlayer = MPRIS(
+                self._busName, int(mprisConf['coalesce_window']),
+                priority=[name.strip() for name in mprisConf['players'].split(',') if name.strip()],
+                followPlaying=mprisConf.getboolean('follow_playing'),
+                callTimeout=float(mprisConf['call_timeout']))
 
-        log.debug('Initializing buttons: %s', list(Button))
+        display.result()
+        fonts.result()
 
-        self._buttons = Buttons()
-        self._buttons.onPressedHandler(self._onButtonPressed)
-        self._buttons.onLongPressHandler(self._onButtonLongPress)
-        self._buttons.onReleasedHandler(self._onButtonReleased)
+        # Pre-render the Latin-1 glyphs in the background, other glyphs are
+        # added on first use
+        self._workers.submit(self._warmGlyphs)
 
-        self._screens = [
-            ArtworkScreen(self._conf, self._display, self._mprisPlayer),
-            NowPlayingInfoScreen(self._conf, self._display, self._mprisPlayer),
-            GifScreen(self._conf, self._display)
+        log.debug('Initializing buttons: %s', list(Button))
+
+        with profile.phase('buttons'):
+            self._buttons = Buttons(self._conf)
+            self._buttons.onPressedHandler(self._onButtonPressed)
+            self._buttons.onLongPressHandler(self._onButtonLongPress)
+            self._buttons.onReleasedHandler(self._onButtonReleased)
+            self._buttons.onChordHandler(self._onButtonChord)
+
+        artworkConf = self._conf['ArtworkScreen']
+        self._artworkDownloader = ArtworkDownloader(
+            DiskCache(artworkConf['download_cache_dir'],
+                      int(artworkConf['download_cache_size']) * 1024 * 1024),
+            float(artworkConf['download_timeout']), self._workers)
+        self._mprisPlayer.setPrefetchHandler(
+            self._prefetchArtwork, int(artworkConf['prefetch_depth']))
+
+        # Screens are created on first activation
+        self._screenFactories = [
+            lambda: ArtworkScreen(self._conf, self._display, self._mprisPlayer,
+                                  self._artworkCache, self._artworkDownloader, self._workers),
+            lambda: NowPlayingInfoScreen(
+                self._conf, self._display, self._mprisPlayer, self._artworkDownloader, self._workers),
+            lambda: ProgressScreen(
+                self._conf, self._display, self._mprisPlayer),
+            lambda: GifScreen(self._conf, self._display, self._workers)
         ]
+        self._screens = [None] * len(self._screenFactories)
         self._activeScreenIndex = 0
-        self._activeScreen = self._screens[self._activeScreenIndex]
-        self._activeScreen.activate()
+
+        # Time of the last screen switch, taken after the previous screen was
+        # deactivated (frames sent later are from the new screen)
+        self.screenSwitchTime = None
+
+        with profile.phase('first screen'):
+            self._activeScreen = self._screen(self._activeScreenIndex)
+            self._activeScreen.activate()
+
+        self._mprisPlayer.setUpdateHandler(self._onPlayerUpdate)
 
         self._resetInactivityTimer()
 
+        self._initMetrics()
+
+    def _initDisplay(self, profile):
+        log.debug('Initializing display')
+
+        with profile.phase('display'):
+            self._display = Display(self._conf)
+            self._display.turnOn()
+
+        with profile.phase('splash'):
+            artworkConf = self._conf['ArtworkScreen']
+            self._artworkCache = ArtworkCache(
+                self._display, int(artworkConf['cache_size']) * 1024 * 1024, self._workers)
+
+            # The fallback artwork is shown until the first screen is ready
+            self._display.image(self._artworkCache.get(
+                artworkConf['fallback_image']))
+
+    def _loadFonts(self, profile):
+        with profile.phase('fonts'):
+            NowPlayingInfoScreen.loadFonts(self._conf)
+
+    def _warmGlyphs(self):
+        for atlas in set(NowPlayingInfoScreen.loadFonts(self._conf)):
+            atlas.warm()
+
+    def _screen(self, index):
+        if self._screens[index] is None:
+            self._screens[index] = self._screenFactories[index]()
+        return self._screens[index]
+
+    def _initMetrics(self):
+        metricsConf = self._conf['Metrics']
+
+        self._metricsFile = metricsConf['textfile']
+        if self._metricsFile:
+            log.debug('Writing metrics to %s', self._metricsFile)
+            GLib.timeout_add_seconds(
+                int(metricsConf['interval']), self._writeMetrics)
+
+        if metricsConf.getboolean('dbus'):
+            self._metricsService = metrics.export_dbus(self._mprisPlayer.bus)
+
+    def _writeMetrics(self):
+        metrics.write_textfile(self._metricsFile)
+        return True
+
     def deinit(self):
         self._buttons.cleanup()
-        if self._timer:
-            self._timer.cancel()
-            self._timer = None
+        self._stopInactivityTimer()
         self._display.turnOff()
+        self._display.close()
+        self._workers.shutdown(wait=False)
 
     def _resetInactivityTimer(self):
         if self._interval <= 0:
             return False
 
         if self._timer:
-            self._timer.cancel()
+            GLib.source_remove(self._timer)
             self._timer = None
 
         inactive = self._inactive
         if self._inactive:
             self._inactive = False
-            self._display.turnOn()
+            self._setDisplayOn(True)
 
         if self._mprisPlayer.playbackStatus() != PlaybackStatus.PLAYING:
             log.debug('Start inactivity timer')
-            self._timer = threading.Timer(
+            self._timer = GLib.timeout_add_seconds(
                 self._interval, self._onInactivityTimeout)
-            self._timer.start()
 
         return inactive
 
@@ -106,26 +209,63 @@ class Player:
 
         log.debug('Cancel inactivity timer')
 
-        self._timer.cancel()
+        GLib.source_remove(self._timer)
         self._timer = None
 
     def _onInactivityTimeout(self):
         log.debug('Turning display off')
         self._timer = None
         self._inactive = True
-        self._display.turnOff()
+        self._setDisplayOn(False)
+
+        # Remove the GLib timeout source
+        return False
+
+    def _setDisplayOn(self, on):
+        '''
+        Screens do not render while the display is off. On wake, the screen
+        is activated again, its first frame is shown before the backlight
+        turns on.
+        '''
+        if on == self._display.status():
+            return
+
+        if on:
+            self._activeScreen.activate()
+            self._display.turnOn()
+        else:
+            self._activeScreen.deactivate()
+            self._display.turnOff()
 
-    def _onPlayerUpdate(self):
-        log.info('Player update: %s [%s/%s/%s, artwork=%s]',
+    def _onPlayerUpdate(self, changed):
+        log.info('Player update: %s [%s/%s/%s, artwork=%s] (changed: %s)',
                  self._mprisPlayer.playbackStatus(),
                  ','.join(self._mprisPlayer.artist()),
                  self._mprisPlayer.album(),
                  self._mprisPlayer.title(),
-                 self._mprisPlayer.artUrl())
+                 self._mprisPlayer.artUrl(),
+                 ', '.join(sorted(changed)))
 
-        self._resetInactivityTimer()
+        if self._resetInactivityTimer():
+            # Woke up, the screen showed the current state on activation
+            return
+
+        if self._display.status():
+            self._activeScreen.onPlayerUpdate(changed)
+
+    def _prefetchArtwork(self, artUrls):
+        imageFiles = []
+        for artUrl in artUrls:
+            if is_http_url(artUrl):
+                path = self._artworkDownloader.get(
+                    artUrl, lambda _url, path: self._artworkCache.prefetch([path]))
+            else:
+                path = art_url_to_path(artUrl)
 
-        self._activeScreen.onPlayerUpdate()
+            if path:
+                imageFiles.append(path)
+
+        self._artworkCache.prefetch(imageFiles)
 
     def _onButtonPressed(self, button):
         log.debug('Button press detected: %s', button)
@@ -142,9 +282,11 @@ class Player:
 
     def _onButtonLongPress(self, button, secondsPressed):
         if button == Button.B:
-            if secondsPressed == 3:
+            if secondsPressed >= 3:
                 log.debug('Long press: %s', self._activeScreenIndex)
-                self._display.setBacklight(not self._display.status())
+                self._setDisplayOn(not self._display.status())
+                # Ignore the release of this press
+                return False
         else:
             self._activeScreen.onButtonLongPress(button, secondsPressed)
 
@@ -157,6 +299,11 @@ class Player:
         else:
             self._activeScreen.onButtonReleased(button, secondsPressed)
 
+    def _onButtonChord(self, buttons):
+        if buttons == {Button.B, Button.Y}:
+            self._resetInactivityTimer()
+            self._mprisPlayer.cyclePlayer()
+
     def _switchToNextScreen(self):
         if len(self._screens) > 1:
             self._activeScreen.deactivate()
@@ -165,5 +312,6 @@ class Player:
 
             log.debug('Activate next screen: %s', self._activeScreenIndex)
 
-            self._activeScreen = self._screens[self._activeScreenIndex]
+            self._activeScreen = self._screen(self._activeScreenIndex)
+            self.screenSwitchTime = monotonic()
             self._activeScreen.activate()
@@ -23,13 +23,21 @@ SOFTWARE.
 '''
 
 import csv
+from gi.repository import GLib
 import logging
-from PIL import Image, ImageFont
-import threading
+import re
+import string
 
+from PIL import Image, ImageDraw
+
+from . import metrics
+from .artwork import art_url_to_path, is_http_url
 from .buttons import Button
-from .display import TextImage
-from .util import color_hex_to_rgb
+from .cache import LRUCache
+from .display import Text, TextImage, decode_animation, line_height, to_rgb565
+from .glyphs import get_atlas
+from .theme import Theme, ThemeCache
+from .util import color_hex_to_rgb, format_duration
 
 
 log = logging.getLogger(__name__)
@@ -52,13 +60,14 @@ class Screen:
     def onButtonReleased(self, button, secondsPressed):
         pass
 
-    def onPlayerUpdate(self):
+    def onPlayerUpdate(self, changed):
         pass
 
 
 class GifScreen(Screen):
-    def __init__(self, conf, display):
+    def __init__(self, conf, display, workers):
         self._display = display
+        self._workers = workers
         self._conf = conf['GifScreen']
 
         parser = csv.reader([self._conf['image']])
@@ -67,59 +76,151 @@ class GifScreen(Screen):
         self._activeImage = 0
         self._numImages = len(self._images)
 
-        self._irq = threading.Event()
-        self._thread = threading.Thread(name='gif', target=self._showGif)
+        # Decoded frames are kept across activations and image switches
+        self._frameCache = LRUCache(
+            int(self._conf['frame_cache_size']) * 1024 * 1024, name='gif frames')
+
+        # Frames are shown by a GLib timeout source, one per frame duration
+        self._active = False
+        self._frames = None
+        self._frame = 0
+        self._source = None
 
     def activate(self):
-        self._irq.clear()
-        self._thread = threading.Thread(name='gif', target=self._showGif)
-        self._thread.start()
+        self._active = True
+
+        imageFile = self._images[self._activeImage]
+        frames = self._frameCache.get(imageFile)
+        if frames is None:
+            self._workers.submit(self._decode, imageFile)
+        else:
+            self._play(frames)
 
     def deactivate(self):
-        self._irq.set()
-        self._thread.join()
-        self._thread = None
+        self._active = False
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
 
     def onButtonPressed(self, button):
         if button == Button.Y:
             if self._numImages > 1:
-                self.deactivate()
+                # The screen is inactive while the display is off
+                active = self._active
+                if active:
+                    self.deactivate()
                 self._activeImage = (self._activeImage + 1) % self._numImages
-                self.activate()
-
-    def _showGif(self):
-        image = Image.open(self._images[self._activeImage])
-
-        run = True
-        frame = 0
-        while run:
-            try:
-                image.seek(frame)
-                self._display.image(image)
-                frame += 1
-                duration = 0.05
-                if 'duration' in image.info:
-                    duration = image.info['duration'] / 1000
-                run = not self._irq.wait(duration)
-            except EOFError:
-                frame = 0
+                if active:
+                    self.activate()
+
+    @metrics.histogram('pidi_screen_render_seconds', 'Time to render a screen', screen='GifScreen').time()
+    def _loadFrames(self, imageFile):
+        frames = self._frameCache.get(imageFile)
+        if frames is None:
+            # Frames are cached in the wire format of the display
+            frames = [(self._display.toFrame(image), duration) for image, duration in decode_animation(
+                imageFile, (self._display.width, self._display.height))]
+            self._frameCache.put(imageFile, frames, sum(
+                frame.nbytes for frame, _duration in frames))
+        return frames
+
+    def _decode(self, imageFile):
+        try:
+            frames = self._loadFrames(imageFile)
+        except OSError as e:
+            log.warning('Failed to load %s: %s', imageFile, e)
+            return
+
+        GLib.idle_add(self._onFramesLoaded, imageFile, frames)
+
+    def _onFramesLoaded(self, imageFile, frames):
+        if self._active and self._source is None and imageFile == self._images[self._activeImage]:
+            self._play(frames)
+
+        # Remove the GLib idle source
+        return False
+
+    def _play(self, frames):
+        self._frames = frames
+        self._frame = 0
+        self._showFrame()
+
+    def _showFrame(self):
+        image, duration = self._frames[self._frame]
+        self._display.image(image)
+        self._frame = (self._frame + 1) % len(self._frames)
+
+        self._source = GLib.timeout_add(
+            max(1, int(duration * 1000)), self._showFrame)
+
+        # Remove this GLib timeout source, the next frame has its own
+        return False
+
+
+# The fields available in line templates: the update keys (see
+# MPRIS.setUpdateHandler()) they depend on and how the value is read
+TEMPLATE_FIELDS = {
+    'artist': ({'xesam:artist'}, lambda mpris: ', '.join(mpris.artist())),
+    'album': ({'xesam:album'}, lambda mpris: mpris.album()),
+    'albumArtist': ({'xesam:albumArtist'}, lambda mpris: ', '.join(mpris.albumArtist())),
+    'title': ({'xesam:title'}, lambda mpris: mpris.title()),
+    'trackNumber': ({'xesam:trackNumber'}, lambda mpris: mpris.trackNumber() or ''),
+    'length': ({'mpris:length'}, lambda mpris: format_duration(mpris.length()) if mpris.length() else ''),
+    'status': ({'PlaybackStatus'}, lambda mpris: mpris.playbackStatus().value),
+    'player': ({'Player', 'Identity'}, lambda mpris: mpris.identity()),
+}
+
+
+class LineTemplate:
+    '''
+    A line text template in str.format syntax (e. g. "{trackNumber}. {title}"),
+    parsed once. fields is the set of update keys the text depends on.
+    '''
+
+    _formatter = string.Formatter()
+
+    def __init__(self, template):
+        self.template = template
+        self._parts = list(LineTemplate._formatter.parse(template))
+
+        self._names = set()
+        for _literal, field, _spec, _conversion in self._parts:
+            if field is None:
+                continue
+            name = re.split(r'[.\[]', field, 1)[0]
+            if name not in TEMPLATE_FIELDS:
+                raise ValueError('Unknown field "{}" in line template: {}'.format(
+                    field, template))
+            self._names.add(name)
+
+        self.fields = set().union(
+            *(TEMPLATE_FIELDS[name][0] for name in self._names))
+
+    def format(self, mprisPlayer):
+        formatter = LineTemplate._formatter
+        values = {name: TEMPLATE_FIELDS[name][1](mprisPlayer)
+                  for name in self._names}
+
+        parts = []
+        for literal, field, spec, conversion in self._parts:
+            parts.append(literal)
+            if field is not None:
+                value, _key = formatter.get_field(field, (), values)
+                parts.append(formatter.format_field(
+                    formatter.convert_field(value, conversion), spec))
+        return ''.join(parts)
 
 
 class NowPlayingInfoScreen(Screen):
-    def __init__(self, conf, display, mprisPlayer):
+
+    def __init__(self, conf, display, mprisPlayer, artworkDownloader, workers):
         self._display = display
         self._mprisPlayer = mprisPlayer
+        self._artworkDownloader = artworkDownloader
+        self._workers = workers
         self._conf = conf['NowPlayingInfoScreen']
 
-        self._fonts = []
-        self._fonts.append(ImageFont.truetype(
-            self._conf['line1_font_face'], int(self._conf['line1_font_size'])))
-        self._fonts.append(ImageFont.truetype(
-            self._conf['line2_font_face'], int(self._conf['line2_font_size'])))
-        self._fonts.append(ImageFont.truetype(
-            self._conf['line3_font_face'], int(self._conf['line3_font_size'])))
-        self._fonts.append(ImageFont.truetype(
-            self._conf['line4_font_face'], int(self._conf['line4_font_size'])))
+        self._fonts = NowPlayingInfoScreen.loadFonts(conf)
 
         self._bgColor = color_hex_to_rgb(self._conf['background'])
 
@@ -131,22 +232,83 @@ class NowPlayingInfoScreen(Screen):
 
         log.debug('Text colors: %s', self._colors)
 
-        self._texts = []
-        self._texts.append(self._conf['line1_text'])
-        self._texts.append(self._conf['line2_text'])
-        self._texts.append(self._conf['line3_text'])
-        self._texts.append(self._conf['line4_text'])
-
-        log.debug('Text templates: %s', self._texts)
+        self._fixedColors = (self._bgColor, self._colors)
+
+        # Colors taken from the artwork (None for fixed colors), and the
+        # artwork file of the current theme
+        self._themes = None
+        self._themeFile = None
+        if self._conf['colors'] == 'artwork':
+            self._themes = ThemeCache(float(self._conf['min_contrast']))
+            self._themeRoles = [self._conf['line{}_theme_color'.format(line)]
+                                for line in range(1, 5)]
+            for role in self._themeRoles:
+                if role not in Theme.COLOR_ROLES:
+                    raise ValueError('Invalid theme color: {}'.format(role))
+        elif self._conf['colors'] != 'fixed':
+            raise ValueError('Invalid colors: {}'.format(self._conf['colors']))
+
+        # Empty lines are None
+        self._templates = []
+        for line in range(1, 5):
+            text = self._conf['line{}_text'.format(line)]
+            self._templates.append(LineTemplate(text) if text else None)
+
+        log.debug('Text templates: %s', [
+                  t.template for t in self._templates if t])
+
+        # The update keys shown on this screen
+        self._fields = set().union(
+            *(t.fields for t in self._templates if t))
+
+        self._maxLines = []
+        self._maxLines.append(int(self._conf['line1_max_lines']))
+        self._maxLines.append(int(self._conf['line2_max_lines']))
+        self._maxLines.append(int(self._conf['line3_max_lines']))
+        self._maxLines.append(int(self._conf['line4_max_lines']))
+
+        self._marquee = []
+        self._marquee.append(self._conf.getboolean('line1_marquee'))
+        self._marquee.append(self._conf.getboolean('line2_marquee'))
+        self._marquee.append(self._conf.getboolean('line3_marquee'))
+        self._marquee.append(self._conf.getboolean('line4_marquee'))
+
+        self._marqueeInterval = int(1000 / float(self._conf['marquee_fps']))
+        self._marqueeStep = int(self._conf['marquee_step'])
 
         self._txtImage = TextImage(
             self._display.width, self._display.height, bgColor=self._bgColor)
 
+        # The current text and layout of each line
+        self._values = [None] * 4
+        self._lines = [None] * 4
+
+        # The current frame (RGB565) and the scrolling lines in it
+        self._frame = None
+        self._marquees = []
+
+        self._active = False
+        self._marqueeSource = None
+
+    @staticmethod
+    def loadFonts(conf):
+        '''
+        Returns the glyph atlases for the fonts of the four lines (fonts are
+        only loaded once).
+        '''
+        conf = conf['NowPlayingInfoScreen']
+        return [get_atlas(conf['line{}_font_face'.format(line)], int(conf['line{}_font_size'.format(line)]))
+                for line in range(1, 5)]
+
     def activate(self):
+        self._active = True
+        if self._themes is not None:
+            self._updateTheme()
         self._showInfo()
 
     def deactivate(self):
-        pass
+        self._active = False
+        self._stopMarquee()
 
     def onButtonPressed(self, button):
         if button == Button.A:
@@ -156,36 +318,323 @@ class NowPlayingInfoScreen(Screen):
         elif button == Button.Y:
             self._mprisPlayer.playPause()
 
-    def onPlayerUpdate(self):
-        self._showInfo()
+    def onPlayerUpdate(self, changed):
+        if self._themes is not None and changed & {'mpris:artUrl', 'Player'} and self._updateTheme():
+            self._showInfo()
+        elif changed & self._fields:
+            self._showInfo(changed)
+
+    def _updateTheme(self):
+        '''
+        Applies the theme of the current artwork if it is cached, otherwise it
+        is extracted in the worker pool. Returns True if the colors changed.
+        '''
+        artUrl = self._mprisPlayer.artUrl()
+        if is_http_url(artUrl):
+            imageFile = self._artworkDownloader.get(
+                artUrl, self._onArtworkDownloaded)
+            if imageFile is None:
+                # The theme is updated when the download completed
+                return False
+        else:
+            imageFile = art_url_to_path(artUrl)
+
+        if imageFile == self._themeFile:
+            return False
+        self._themeFile = imageFile
+
+        if imageFile is None:
+            return self._applyTheme(None)
+
+        theme = self._themes.cached(imageFile)
+        if theme is None:
+            self._workers.submit(self._loadTheme, imageFile)
+            return False
+        return self._applyTheme(theme)
+
+    def _loadTheme(self, imageFile):
+        try:
+            theme = self._themes.get(imageFile)
+        except (OSError, ValueError) as e:
+            log.warning('Failed to extract colors of artwork %s: %s',
+                        imageFile, e)
+            theme = None
+
+        GLib.idle_add(self._onThemeLoaded, imageFile, theme)
+
+    def _onThemeLoaded(self, imageFile, theme):
+        if imageFile == self._themeFile and self._applyTheme(theme) and self._active:
+            self._showInfo()
+
+        # Remove the GLib idle source
+        return False
+
+    def _onArtworkDownloaded(self, url, _path):
+        # Called from a worker thread
+        GLib.idle_add(self._onArtworkDownloadedIdle, url)
+
+    def _onArtworkDownloadedIdle(self, url):
+        if self._active and url == self._mprisPlayer.artUrl() and self._updateTheme():
+            self._showInfo()
+
+        # Remove the GLib idle source
+        return False
+
+    def _applyTheme(self, theme):
+        '''
+        Sets the colors of the theme (the fixed colors if theme is None).
+        Returns True if they changed, all lines are laid out again then.
+        '''
+        if theme is None:
+            bgColor, colors = self._fixedColors
+        else:
+            bgColor = theme.background
+            colors = [theme.color(role) for role in self._themeRoles]
+
+        if bgColor == self._bgColor and colors == self._colors:
+            return False
+
+        log.debug('Text colors: %s on %s', colors, bgColor)
+        self._bgColor = bgColor
+        self._colors = colors
+        self._txtImage.setBgColor(bgColor)
+        self._values = [None] * 4
+        return True
+
+    def _startMarquee(self):
+        if self._marquees and self._active and self._marqueeSource is None:
+            self._marqueeSource = GLib.timeout_add(
+                self._marqueeInterval, self._scroll)
+
+    def _stopMarquee(self):
+        if self._marqueeSource is not None:
+            GLib.source_remove(self._marqueeSource)
+            self._marqueeSource = None
+
+    def _scroll(self):
+        if not self._marquees:
+            self._marqueeSource = None
+            return False
+
+        # Move the window over the pre-rendered strips, only the bands of the
+        # scrolling lines change
+        for marquee in self._marquees:
+            strip, period, (x, y, width, height), offset, _txt, top = marquee
+            offset = (offset + self._marqueeStep) % period
+            self._display.paste(
+                self._frame, strip[top:top + height, offset:offset + width], (x, y))
+            marquee[3] = offset
+
+        self._display.image(self._frame.copy())
+        return True
+
+    @metrics.histogram('pidi_screen_render_seconds', 'Time to render a screen', screen='NowPlayingInfoScreen').time()
+    def _showInfo(self, changed=None):
+        '''
+        Lays out the lines that depend on the changed fields (all lines if
+        changed is None) and draws the screen if any of them changed.
+        '''
+        redraw = changed is None
+        for i, template in enumerate(self._templates):
+            if template is None or not (changed is None or changed & template.fields):
+                continue
+
+            value = template.format(self._mprisPlayer)
+            if value == self._values[i]:
+                continue
+
+            self._values[i] = value
+            self._lines[i] = self._txtImage.layout(
+                value, self._fonts[i], color=self._colors[i], maxLines=self._maxLines[i],
+                marquee=self._marquee[i]) if value else None
+            redraw = True
+
+        if not redraw:
+            return
 
-    def _showInfo(self):
         self._txtImage.reset()
+        for txt in self._lines:
+            if txt is not None:
+                self._txtImage.addText(txt)
+
+        self._frame = self._display.toFrame(self._txtImage.draw())
+
+        # Scrolling lines are rendered and converted once, each
+        # [strip, period, region, offset, text, top]. The region is the part
+        # of the line on the display, starting at row top of the strip (texts
+        # taller than the display are cut at the top and bottom). Unchanged
+        # lines keep scrolling where they are.
+        previous = {marquee[4]: marquee for marquee in self._marquees}
+        self._marquees = []
+        for txt, (x, y, width, height) in self._txtImage.marquees():
+            top = max(0, -y)
+            bottom = min(height, self._display.height - y)
+            if top >= bottom:
+                continue
+
+            if txt in previous:
+                strip, period, _region, offset = previous[txt][:4]
+            else:
+                strip, period = txt.renderStrip(width // 4, self._bgColor)
+                strip, offset = to_rgb565(strip), 0
+            region = (x, y + top, width, bottom - top)
+            self._marquees.append([strip, period, region, offset, txt, top])
+            self._display.paste(
+                self._frame, strip[top:bottom, offset:offset + width], region[:2])
+
+        self._display.image(self._frame.copy())
+        self._startMarquee()
+
+
+class ProgressScreen(Screen):
+    # Fields shown above the progress bar
+    FIELDS = {'xesam:artist', 'xesam:title', 'mpris:length', 'Player'}
+
+    MARGIN = 16
+    BAR_HEIGHT = 8
+
+    def __init__(self, conf, display, mprisPlayer):
+        self._display = display
+        self._mprisPlayer = mprisPlayer
+        self._conf = conf['ProgressScreen']
+
+        self._tickInterval = int(1000 / float(self._conf['tick_rate']))
 
-        artist = ', '.join(self._mprisPlayer.artist())
-        album = self._mprisPlayer.album()
-        title = self._mprisPlayer.title()
-        for i, t in enumerate(self._texts):
-            if len(t) > 0:
-                log.debug(t.format(artist=artist, album=album, title=title))
-                self._txtImage.add(
-                    t.format(artist=artist, album=album, title=title), self._fonts[i], color=self._colors[i])
+        self._bgColor = color_hex_to_rgb(self._conf['background'])
+        self._barColor = color_hex_to_rgb(self._conf['bar_color'])
+        self._barBackground = color_hex_to_rgb(
+            self._conf['bar_background'])
+
+        self._fonts = {}
+        self._colors = {}
+        for item in ('title', 'artist', 'time'):
+            self._fonts[item] = get_atlas(self._conf['{}_font_face'.format(
+                item)], int(self._conf['{}_font_size'.format(item)]))
+            self._colors[item] = color_hex_to_rgb(
+                self._conf['{}_font_color'.format(item)])
+
+        # Elapsed and remaining time at the bottom, the bar above them and
+        # the title and artist in the remaining space
+        width = self._display.width - 2 * ProgressScreen.MARGIN
+        timeHeight = line_height(self._fonts['time'])
+        timeY = self._display.height - ProgressScreen.MARGIN - timeHeight
+        barY = timeY - ProgressScreen.MARGIN // 2 - ProgressScreen.BAR_HEIGHT
+
+        self._timeBox = (ProgressScreen.MARGIN, timeY, width, timeHeight)
+        self._barBox = (ProgressScreen.MARGIN, barY,
+                        width, ProgressScreen.BAR_HEIGHT)
+        self._txtImage = TextImage(
+            self._display.width, barY - ProgressScreen.MARGIN // 2, bgColor=self._bgColor)
 
-        self._display.image(self._txtImage.draw())
+        # The current frame (RGB565) and the progress drawn into it
+        self._frame = None
+        self._bar = None
+        self._times = None
+
+        self._source = None
+
+    def activate(self):
+        self._showTrack()
+        self._source = GLib.timeout_add(self._tickInterval, self._tick)
+
+    def deactivate(self):
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
+
+    def onButtonPressed(self, button):
+        if button == Button.A:
+            self._mprisPlayer.previous()
+        elif button == Button.X:
+            self._mprisPlayer.next()
+        elif button == Button.Y:
+            self._mprisPlayer.playPause()
+
+    def onPlayerUpdate(self, changed):
+        if self._source is None:
+            return
+
+        if changed & ProgressScreen.FIELDS:
+            self._showTrack()
+        else:
+            self._showProgress()
+
+    def _tick(self):
+        # The position is extrapolated, ticks do not call the media player
+        self._showProgress()
+        return True
+
+    @metrics.histogram('pidi_screen_render_seconds', 'Time to render a screen', screen='ProgressScreen').time()
+    def _showTrack(self):
+        self._txtImage.reset()
+        self._txtImage.add(self._mprisPlayer.title(), self._fonts['title'],
+                           color=self._colors['title'], maxLines=2)
+        self._txtImage.add(', '.join(self._mprisPlayer.artist()), self._fonts['artist'],
+                           color=self._colors['artist'], maxLines=1)
+
+        image = Image.new(
+            'RGB', (self._display.width, self._display.height), color=self._bgColor)
+        image.paste(self._txtImage.draw(), (0, 0))
+
+        self._frame = self._display.toFrame(image)
+        self._bar = None
+        self._times = None
+        self._showProgress()
+
+    def _showProgress(self):
+        position = self._mprisPlayer.position()
+        length = self._mprisPlayer.length()
+
+        x, y, width, height = self._barBox
+        bar = int(width * position / length) if length > 0 else 0
+        # The remaining time is rounded up, both add up to the length
+        times = (format_duration(position),
+                 '-' + format_duration(length - position + 999999) if length > 0 else '')
+        if bar == self._bar and times == self._times:
+            return
+
+        # Only the bar and time regions are converted, the display sends
+        # only the changed tiles
+        if bar != self._bar:
+            image = Image.new('RGB', (width, height),
+                              color=self._barBackground)
+            if bar > 0:
+                ImageDraw.Draw(image).rectangle(
+                    (0, 0, bar - 1, height - 1), fill=self._barColor)
+            self._display.paste(self._frame, image, (x, y))
+            self._bar = bar
+
+        if times != self._times:
+            x, y, width, height = self._timeBox
+            image = Image.new('RGB', (width, height), color=self._bgColor)
+            draw = ImageDraw.Draw(image)
+            for text, align in zip(times, ('left', 'right')):
+                Text(text, self._fonts['time'], draw, align=align, margin=(0, 0),
+                     color=self._colors['time']).drawText(0, 0, width)
+            self._display.paste(self._frame, image, (x, y))
+            self._times = times
+
+        self._display.image(self._frame.copy())
 
 
 class ArtworkScreen(Screen):
-    def __init__(self, conf, display, mprisPlayer):
+    def __init__(self, conf, display, mprisPlayer, artworkCache, artworkDownloader, workers):
         self._conf = conf['ArtworkScreen']
         self._defaultImage = self._conf['fallback_image']
         self._display = display
         self._mprisPlayer = mprisPlayer
+        self._artworkCache = artworkCache
+        self._artworkDownloader = artworkDownloader
+        self._workers = workers
         self._artUrl = None
+        self._active = False
 
     def activate(self):
+        self._active = True
         self._showArtwork()
 
     def deactivate(self):
+        self._active = False
         self._artUrl = None
 
     def onButtonPressed(self, button):
@@ -196,17 +645,61 @@ class ArtworkScreen(Screen):
         elif button == Button.Y:
             self._mprisPlayer.playPause()
 
-    def onPlayerUpdate(self):
-        self._showArtwork()
+    def onPlayerUpdate(self, changed):
+        if 'mpris:artUrl' in changed:
+            self._showArtwork()
+
+    def _onArtworkDownloaded(self, url, _path):
+        # Called from a worker thread
+        GLib.idle_add(self._onArtworkDownloadedIdle, url)
+
+    def _onArtworkDownloadedIdle(self, url):
+        if self._active and url == self._mprisPlayer.artUrl():
+            self._showArtwork()
+
+        # Remove the GLib idle source
+        return False
 
+    @metrics.histogram('pidi_screen_render_seconds', 'Time to render a screen', screen='ArtworkScreen').time()
     def _showArtwork(self):
         artUrl = self._mprisPlayer.artUrl()
-
-        if artUrl.startswith('file://'):
-            artUrl = artUrl[len('file://'):]
+        if is_http_url(artUrl):
+            # Shows the fallback image until the download completed
+            artUrl = self._artworkDownloader.get(
+                artUrl, self._onArtworkDownloaded)
         else:
+            artUrl = art_url_to_path(artUrl)
+
+        if not artUrl:
             artUrl = self._defaultImage
 
         if self._artUrl is None or self._artUrl != artUrl:
             self._artUrl = artUrl
-            self._display.imageFile(artUrl)
+
+            # Artwork that is not cached yet is decoded in the worker pool
+            frame = self._artworkCache.cached(artUrl)
+            if frame is None:
+                self._workers.submit(self._loadArtwork, artUrl)
+            else:
+                self._display.image(frame)
+
+    def _loadArtwork(self, artUrl):
+        try:
+            frame = self._artworkCache.get(artUrl)
+        except OSError as e:
+            log.warning('Failed to load artwork %s: %s', artUrl, e)
+            try:
+                frame = self._artworkCache.get(self._defaultImage)
+            except OSError as e:
+                log.error('Failed to load fallback image %s: %s',
+                          self._defaultImage, e)
+                return
+
+        GLib.idle_add(self._onArtworkLoaded, artUrl, frame)
+
+    def _onArtworkLoaded(self, artUrl, frame):
+        if self._active and artUrl == self._artUrl:
+            self._display.image(frame)
+
+        # Remove the GLib idle source
+        return False
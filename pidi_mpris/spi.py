@@ -0,0 +1,194 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import logging
+import os
+from time import monotonic, sleep
+
+
+log = logging.getLogger(__name__)
+
+# Pirate Audio wiring (SPI0, front chip select)
+SPI_PORT = 0
+SPI_CS = 1
+DC_PIN = 9
+BACKLIGHT_PIN = 13
+
+BUFSIZ_PATH = '/sys/module/spidev/parameters/bufsiz'
+DEFAULT_BUFSIZ = 4096
+
+# ST7789 commands
+SWRESET = 0x01
+SLPOUT = 0x11
+INVON = 0x21
+DISPON = 0x29
+CASET = 0x2A
+RASET = 0x2B
+RAMWR = 0x2C
+MADCTL = 0x36
+COLMOD = 0x3A
+PORCTRL = 0xB2
+GCTRL = 0xB7
+VCOMS = 0xBB
+LCMCTRL = 0xC0
+VDVVRHEN = 0xC2
+VRHS = 0xC3
+VDVS = 0xC4
+FRCTRL2 = 0xC6
+PWCTRL1 = 0xD0
+PVGAMCTRL = 0xE0
+NVGAMCTRL = 0xE1
+
+# Controller setup of the Pirate Audio display, the same as the ST7789 library
+# uses (the frames are rotated in software)
+INIT_SEQUENCE = (
+    (MADCTL, [0x70]),
+    (PORCTRL, [0x0C, 0x0C, 0x00, 0x33, 0x33]),
+    (COLMOD, [0x05]),  # 16 bit per pixel (RGB565)
+    (GCTRL, [0x14]),
+    (VCOMS, [0x37]),
+    (LCMCTRL, [0x2C]),
+    (VDVVRHEN, [0x01]),
+    (VRHS, [0x12]),
+    (VDVS, [0x20]),
+    (PWCTRL1, [0xA4, 0xA1]),
+    (FRCTRL2, [0x0F]),
+    (PVGAMCTRL, [0xD0, 0x04, 0x0D, 0x11, 0x13, 0x2B,
+                 0x3F, 0x54, 0x4C, 0x18, 0x0D, 0x0B, 0x1F, 0x23]),
+    (NVGAMCTRL, [0xD0, 0x04, 0x0C, 0x11, 0x13, 0x2C,
+                 0x3F, 0x44, 0x51, 0x2F, 0x1F, 0x1F, 0x20, 0x23]),
+    (INVON, []),
+    (SLPOUT, []),
+    (DISPON, []),
+)
+
+
+def spidev_bufsiz():
+    '''
+    Returns the largest transfer size of the spidev driver. It can be raised
+    with the kernel parameter spidev.bufsiz (e. g. spidev.bufsiz=131072 in
+    /boot/cmdline.txt).
+    '''
+    try:
+        with open(BUFSIZ_PATH) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return DEFAULT_BUFSIZ
+
+
+class SpidevPanel:
+    '''
+    The ST7789 display of the Pirate Audio board, driven through /dev/spidev
+    directly. Pixel data is passed to the driver without conversion and sent
+    in transfers as large as the driver allows.
+    '''
+
+    def __init__(self, spiSpeed, width=240, height=240):
+        import spidev
+        import RPi.GPIO as GPIO
+
+        self.width = width
+        self.height = height
+        self.spiSpeed = spiSpeed
+        self.bufsiz = spidev_bufsiz()
+
+        self._gpio = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        GPIO.setup(DC_PIN, GPIO.OUT)
+        GPIO.setup(BACKLIGHT_PIN, GPIO.OUT)
+
+        self._spi = spidev.SpiDev(SPI_PORT, SPI_CS)
+        self._spi.mode = 0
+        self._spi.lsbfirst = False
+        self._spi.max_speed_hz = spiSpeed
+
+        log.debug('spidev%s.%s: speed=%s Hz, bufsiz=%s',
+                  SPI_PORT, SPI_CS, spiSpeed, self.bufsiz)
+
+        self._init()
+
+    def _init(self):
+        self._command(SWRESET)
+        sleep(0.15)
+
+        for command, data in INIT_SEQUENCE:
+            self._command(command)
+            if data:
+                self._data(data)
+
+        sleep(0.1)
+
+    def setBacklight(self, value):
+        self._gpio.output(BACKLIGHT_PIN, value)
+
+    def setWindow(self, x0, y0, x1, y1):
+        self._command(CASET)
+        self._data([x0 >> 8, x0 & 0xFF, x1 >> 8, x1 & 0xFF])
+        self._command(RASET)
+        self._data([y0 >> 8, y0 & 0xFF, y1 >> 8, y1 & 0xFF])
+        self._command(RAMWR)
+
+    def write(self, data):
+        self._gpio.output(DC_PIN, 1)
+
+        # writebytes2 takes any buffer without copying it into a list
+        view = memoryview(data).cast('B')
+        for start in range(0, len(view), self.bufsiz):
+            self._spi.writebytes2(view[start:start + self.bufsiz])
+
+    def _command(self, command):
+        self._gpio.output(DC_PIN, 0)
+        self._spi.writebytes([command])
+
+    def _data(self, data):
+        self._gpio.output(DC_PIN, 1)
+        self._spi.writebytes(data)
+
+
+def measure_throughput(panel, frames=100):
+    '''
+    Sends full frames to the panel as fast as possible and returns the
+    achieved throughput.
+    '''
+    frameSize = panel.width * panel.height * 2
+
+    # Alternate between two frames with random content
+    buffers = [os.urandom(frameSize), os.urandom(frameSize)]
+
+    start = monotonic()
+    for frame in range(frames):
+        panel.setWindow(0, 0, panel.width - 1, panel.height - 1)
+        panel.write(buffers[frame % 2])
+    duration = monotonic() - start
+
+    bitsPerSecond = frames * frameSize * 8 / duration
+    return {
+        'frames': frames,
+        'seconds': round(duration, 3),
+        'framesPerSecond': round(frames / duration, 1),
+        'megabitsPerSecond': round(bitsPerSecond / 1e6, 2),
+        'spiSpeedUtilization': round(bitsPerSecond / panel.spiSpeed, 3),
+        'bufsiz': getattr(panel, 'bufsiz', None)
+    }
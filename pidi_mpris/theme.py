@@ -0,0 +1,191 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import logging
+
+import numpy as np
+from PIL import Image
+
+from . import metrics
+from .artwork import file_key
+from .cache import LRUCache
+
+
+log = logging.getLogger(__name__)
+
+# Colours are extracted from a copy of the artwork downsampled to
+# SAMPLE_SIZE x SAMPLE_SIZE pixels, quantized to QUANT_BITS bits per channel
+SAMPLE_SIZE = 32
+QUANT_BITS = 3
+
+# Colours covering less than this share of the artwork are not used as
+# primary colour
+MIN_SHARE = 0.02
+
+# Number of themes kept in memory
+CACHE_ENTRIES = 64
+
+WHITE = np.array([255.0, 255.0, 255.0])
+BLACK = np.zeros(3)
+
+
+class Theme:
+    '''
+    Colours derived from an artwork: the background and the font colours
+    (by role, see COLOR_ROLES), all readable on the background.
+    '''
+
+    COLOR_ROLES = ('default', 'primary', 'muted')
+
+    def __init__(self, background, default, primary, muted):
+        self.background = background
+        self.default = default
+        self.primary = primary
+        self.muted = muted
+
+    def color(self, role):
+        return getattr(self, role)
+
+    def __repr__(self):
+        return 'Theme(background={}, default={}, primary={}, muted={})'.format(
+            self.background, self.default, self.primary, self.muted)
+
+
+def luminance(colors):
+    '''
+    Returns the relative luminance (WCAG 2) of RGB colours (0-255, last
+    axis).
+    '''
+    c = np.asarray(colors, dtype=np.float64) / 255.0
+    c = np.where(c <= 0.03928, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    return c @ np.array([0.2126, 0.7152, 0.0722])
+
+
+def contrast_ratio(colors, background):
+    '''
+    Returns the contrast ratio (WCAG 2, 1 to 21) of colours to a background.
+    '''
+    a = luminance(colors)
+    b = luminance(background)
+    return (np.maximum(a, b) + 0.05) / (np.minimum(a, b) + 0.05)
+
+
+def ensure_contrast(color, background, minContrast):
+    '''
+    Returns the colour, blended towards white or black (whichever contrasts
+    more with the background) just enough to reach minContrast. If even
+    white or black is not enough, that is returned.
+    '''
+    extreme = _extreme(background)
+    blends = color + np.linspace(0, 1, 21)[:, np.newaxis] * (extreme - color)
+    enough = np.nonzero(contrast_ratio(blends, background) >= minContrast)[0]
+    return blends[enough[0]] if len(enough) else extreme
+
+
+def _extreme(background):
+    return WHITE if contrast_ratio(WHITE, background) >= contrast_ratio(BLACK, background) else BLACK
+
+
+def _to_rgb(color):
+    return tuple(int(round(c)) for c in color)
+
+
+@metrics.histogram('pidi_theme_extract_seconds', 'Time to extract the colour theme of an artwork').time()
+def extract_theme(image, minContrast):
+    '''
+    Returns the Theme of a PIL image: the most frequent colour as background
+    and the most contrasting (and saturated) frequent colour as primary
+    colour.
+    '''
+    image.draft('RGB', (SAMPLE_SIZE, SAMPLE_SIZE))
+    sample = image.convert('RGB').resize(
+        (SAMPLE_SIZE, SAMPLE_SIZE), Image.BOX)
+    pixels = np.asarray(sample, dtype=np.uint8).reshape(-1, 3)
+
+    # Histogram of the quantized colours, with the mean colour of each bin
+    q = (pixels >> (8 - QUANT_BITS)).astype(np.intp)
+    bins = (q[:, 0] << (2 * QUANT_BITS)) | (q[:, 1] << QUANT_BITS) | q[:, 2]
+    nbins = 1 << (3 * QUANT_BITS)
+    counts = np.bincount(bins, minlength=nbins)
+    sums = np.stack([np.bincount(bins, weights=pixels[:, c], minlength=nbins)
+                     for c in range(3)], axis=1)
+
+    used = np.nonzero(counts)[0]
+    counts = counts[used]
+    means = sums[used] / counts[:, np.newaxis]
+
+    background = means[np.argmax(counts)]
+
+    # The background must leave room for readable text
+    extreme = _extreme(background)
+    if contrast_ratio(extreme, background) < minContrast:
+        background = ensure_contrast(background, extreme, minContrast)
+
+    # Without frequent colours (e. g. gradients) the most populated bin is
+    # used
+    frequent = means[counts >= min(MIN_SHARE * len(pixels), counts.max())]
+    saturation = (frequent.max(axis=1) - frequent.min(axis=1)) / 255.0
+    score = contrast_ratio(frequent, background) * (0.5 + saturation)
+    primary = ensure_contrast(
+        frequent[np.argmax(score)], background, minContrast)
+
+    default = ensure_contrast(
+        background + 0.9 * (extreme - background), background, minContrast)
+    muted = ensure_contrast(
+        background + 0.6 * (extreme - background), background, minContrast)
+
+    return Theme(_to_rgb(background), _to_rgb(default), _to_rgb(primary), _to_rgb(muted))
+
+
+class ThemeCache:
+    '''
+    Themes extracted from artwork files. Entries are keyed by file path,
+    modification time and size (like the ArtworkCache).
+    '''
+
+    def __init__(self, minContrast, maxEntries=CACHE_ENTRIES):
+        self._minContrast = minContrast
+        self._cache = LRUCache(maxEntries, name='theme')
+
+    def get(self, imageFile):
+        key = file_key(imageFile)
+
+        theme = self._cache.get(key)
+        if theme is None:
+            with Image.open(imageFile) as image:
+                theme = extract_theme(image, self._minContrast)
+            log.debug('Theme of %s: %s', imageFile, theme)
+            self._cache.put(key, theme)
+        return theme
+
+    def cached(self, imageFile):
+        '''
+        Returns the theme if it is in the cache, otherwise (or if the file
+        does not exist) None.
+        '''
+        try:
+            key = file_key(imageFile)
+        except OSError:
+            return None
+        return self._cache.get(key) if key in self._cache else None
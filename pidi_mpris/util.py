@@ -22,7 +22,56 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+from contextlib import contextmanager
+import threading
+from time import perf_counter
+
 
 def color_hex_to_rgb(color):
     h = color.lstrip('#')
     return tuple(int(h[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def format_duration(microseconds):
+    '''
+    Formats a duration in microseconds (as used by MPRIS) as m:ss or h:mm:ss.
+    '''
+    minutes, seconds = divmod(int(microseconds // 1000000), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '{}:{:02}:{:02}'.format(hours, minutes, seconds)
+    return '{}:{:02}'.format(minutes, seconds)
+
+
+class StartupProfile:
+    '''
+    Records the start time and duration of startup phases (possibly running
+    in parallel threads).
+    '''
+
+    def __init__(self):
+        self._start = perf_counter()
+        self._phases = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            end = perf_counter()
+            with self._lock:
+                self._phases.append((start - self._start, end - start,
+                                     name, threading.current_thread().name))
+
+    def report(self):
+        lines = ['{:<16} {:>10} {:>10}  {}'.format(
+            'Phase', 'Start/ms', 'Time/ms', 'Thread')]
+        with self._lock:
+            for start, duration, name, thread in sorted(self._phases):
+                lines.append('{:<16} {:>10.1f} {:>10.1f}  {}'.format(
+                    name, start * 1000, duration * 1000, thread))
+        lines.append('{:<16} {:>10.1f}'.format(
+            'total', (perf_counter() - self._start) * 1000))
+        return '\n'.join(lines)
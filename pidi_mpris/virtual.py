@@ -0,0 +1,233 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from collections import deque
+import logging
+import re
+import threading
+from time import monotonic, sleep
+
+import numpy as np
+from PIL import Image
+
+from .buttons import Button
+
+
+log = logging.getLogger(__name__)
+
+
+class VirtualFrame:
+    def __init__(self, startTime, endTime, window, numBytes, transferTime):
+        self.startTime = startTime
+        self.endTime = endTime
+        self.window = window
+        self.numBytes = numBytes
+        self.transferTime = transferTime
+
+
+class VirtualPanel:
+    '''
+    In-memory replacement for the ST7789 display. Keeps the RGB565 frame
+    buffer of the display, records all writes with timestamps and simulates
+    the SPI transfer time for the configured SPI speed.
+    '''
+
+    def __init__(self, spiSpeed, history, width=240, height=240):
+        self.width = width
+        self.height = height
+        self.spiSpeed = spiSpeed
+        self.backlight = True
+
+        self.framebuffer = np.zeros((height, width), dtype='>u2')
+        self.frames = deque(maxlen=history)
+        self.bytesWritten = 0
+
+        # Called with each VirtualFrame after it was written
+        self.frameHandler = None
+
+        self._window = (0, 0, width - 1, height - 1)
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def setBacklight(self, value):
+        self.backlight = value
+
+    def setWindow(self, x0, y0, x1, y1):
+        self._window = (x0, y0, x1, y1)
+        self._offset = 0
+
+    def write(self, data):
+        startTime = monotonic()
+
+        x0, y0, x1, y1 = self._window
+        windowWidth = x1 - x0 + 1
+        pixels = np.frombuffer(data, dtype='>u2')
+
+        with self._lock:
+            # Continue writing where the previous write of this window ended
+            window = self.framebuffer[y0:y1 + 1, x0:x1 + 1].reshape(-1)
+            window[self._offset:self._offset + len(pixels)] = pixels
+            self.framebuffer[y0:y1 + 1, x0:x1 + 1] = window.reshape(-1, windowWidth)
+            self._offset += len(pixels)
+
+        transferTime = len(data) * 8 / self.spiSpeed
+        sleep(transferTime)
+
+        frame = VirtualFrame(startTime, monotonic(), self._window,
+                             len(data), transferTime)
+        self.frames.append(frame)
+        self.bytesWritten += len(data)
+
+        if self.frameHandler:
+            self.frameHandler(frame)
+
+    def snapshot(self, rotation=90):
+        '''
+        Returns the frame buffer content as RGB image (in the orientation of
+        the images passed to the display).
+        '''
+        with self._lock:
+            pixels = self.framebuffer.astype(np.uint16)
+
+        rgb = np.stack([(pixels >> 8) & 0xF8,
+                        (pixels >> 3) & 0xFC,
+                        (pixels << 3) & 0xF8], axis=-1).astype(np.uint8)
+        return Image.fromarray(np.rot90(rgb, -(rotation // 90)).copy(), 'RGB')
+
+
+class VirtualGPIO:
+    '''
+    Replacement for the RPi.GPIO module with buttons that are pressed and
+    released by calling press()/release() or by playing a script.
+
+    A script is a sequence of steps, separated by spaces or commas:
+      2.5      wait 2.5 seconds
+      X        press and release button X (held for 0.1 seconds)
+      B:3.5    hold button B for 3.5 seconds
+      A+X:0.5  press buttons A and X together for 0.5 seconds
+    '''
+
+    BCM = 'BCM'
+    IN = 'IN'
+    OUT = 'OUT'
+    PUD_UP = 'PUD_UP'
+    FALLING = 'FALLING'
+    RISING = 'RISING'
+    BOTH = 'BOTH'
+    LOW = 0
+    HIGH = 1
+
+    CLICK_DURATION = 0.1
+
+    def __init__(self):
+        self._levels = {}
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def setmode(self, _mode):
+        pass
+
+    def setup(self, pin, _direction, pull_up_down=None):
+        self._levels[pin] = VirtualGPIO.HIGH if pull_up_down == VirtualGPIO.PUD_UP else VirtualGPIO.LOW
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self._callbacks[pin] = (edge, callback)
+
+    def input(self, pin):
+        return self._levels.get(pin, VirtualGPIO.HIGH)
+
+    def cleanup(self, pin=None):
+        if pin is None:
+            self._callbacks.clear()
+        else:
+            self._callbacks.pop(pin, None)
+
+    def press(self, button):
+        self._setLevel(button.value, VirtualGPIO.LOW)
+
+    def release(self, button):
+        self._setLevel(button.value, VirtualGPIO.HIGH)
+
+    def play(self, script):
+        '''
+        Plays the script in a background thread.
+        '''
+        steps = parse_button_script(script)
+        thread = threading.Thread(
+            name='button-script', target=self._play, args=(steps,), daemon=True)
+        thread.start()
+        return thread
+
+    def _play(self, steps):
+        for buttons, duration in steps:
+            if not buttons:
+                sleep(duration)
+                continue
+
+            log.debug('Virtual buttons %s pressed for %ss',
+                      [button.label for button in buttons], duration)
+            for button in buttons:
+                self.press(button)
+            sleep(duration)
+            for button in buttons:
+                self.release(button)
+
+    def _setLevel(self, pin, level):
+        with self._lock:
+            if self._levels.get(pin) == level:
+                return
+            self._levels[pin] = level
+            edge, callback = self._callbacks.get(pin, (None, None))
+
+        falling = level == VirtualGPIO.LOW
+        if callback and (edge == VirtualGPIO.BOTH or (edge == VirtualGPIO.FALLING) == falling):
+            callback(pin)
+
+
+def parse_button_script(script):
+    '''
+    Parses a virtual button script into a list of (buttons, duration) steps,
+    a step without buttons is a pause.
+    '''
+    buttons = {button.label: button for button in Button}
+
+    steps = []
+    for token in re.split(r'[\s,]+', script.strip()):
+        if not token:
+            continue
+
+        try:
+            steps.append(([], float(token)))
+            continue
+        except ValueError:
+            pass
+
+        labels, _sep, duration = token.partition(':')
+        try:
+            stepButtons = [buttons[label.upper()] for label in labels.split('+')]
+        except KeyError:
+            raise ValueError('Invalid button in script: {}'.format(token))
+        steps.append((stepButtons, float(duration)
+                      if duration else VirtualGPIO.CLICK_DURATION))
+    return steps
@@ -41,4 +41,4 @@ setup(name='pidi-mpris',
           ]),
           ('/etc', ['conf/pidi-mpris.conf'])
       ],
-      python_requires='>=3.6')
+      python_requires='>=3.7')
@@ -0,0 +1,181 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+
+from pidi_mpris.artwork import ArtworkDownloader, DiskCache, file_key
+
+
+class ArtworkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    FILES = {
+        '/a.jpg': b'a' * 100,
+        '/b.jpg': b'b' * 100,
+        '/c.jpg': b'c' * 100,
+    }
+    REDIRECTS = {'/moved.jpg': '/a.jpg'}
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+
+        if self.path in ArtworkHandler.REDIRECTS:
+            self._respond(302, b'', Location=ArtworkHandler.REDIRECTS[self.path])
+        elif self.path in ArtworkHandler.FILES:
+            self._respond(200, ArtworkHandler.FILES[self.path])
+        else:
+            self._respond(404, b'not found')
+
+    def _respond(self, status, body, **headers):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ArtworkHandler)
+    server.requests = []
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def workers():
+    workers = ThreadPoolExecutor(max_workers=1)
+    yield workers
+    workers.shutdown(wait=True)
+
+
+def download(downloader, url):
+    '''
+    Returns the path of the artwork, waits for the download if necessary
+    (None if it failed).
+    '''
+    path = downloader.get(url, lambda _url, path: None)
+    if path is None:
+        # One download at a time, a later task runs after it completed
+        downloader._workers.submit(lambda: None).result()
+        path = downloader._diskCache.path(url)
+    return path
+
+
+def test_download_is_cached(server, workers, tmp_path):
+    downloader = ArtworkDownloader(DiskCache(str(tmp_path), 1000), 5, workers)
+
+    path = download(downloader, server.url + '/a.jpg')
+    with open(path, 'rb') as f:
+        assert f.read() == ArtworkHandler.FILES['/a.jpg']
+
+    key = file_key(path)
+    assert downloader.get(server.url + '/a.jpg', None) == path
+    assert server.requests == ['/a.jpg']
+
+    # Lookups must not change the keys of the in-memory caches
+    assert file_key(path) == key
+
+
+def test_least_recently_used_file_is_evicted(server, workers, tmp_path):
+    diskCache = DiskCache(str(tmp_path), 250)
+    downloader = ArtworkDownloader(diskCache, 5, workers)
+
+    download(downloader, server.url + '/a.jpg')
+    download(downloader, server.url + '/b.jpg')
+    assert diskCache.path(server.url + '/a.jpg') is not None
+
+    download(downloader, server.url + '/c.jpg')
+
+    assert diskCache.path(server.url + '/a.jpg') is not None
+    assert diskCache.path(server.url + '/b.jpg') is None
+    assert diskCache.path(server.url + '/c.jpg') is not None
+
+
+def test_redirect_is_followed(server, workers, tmp_path):
+    downloader = ArtworkDownloader(DiskCache(str(tmp_path), 1000), 5, workers)
+
+    path = download(downloader, server.url + '/moved.jpg')
+
+    with open(path, 'rb') as f:
+        assert f.read() == ArtworkHandler.FILES['/a.jpg']
+    assert server.requests == ['/moved.jpg', '/a.jpg']
+
+
+def test_missing_artwork_is_not_cached(server, workers, tmp_path):
+    downloaded = []
+    downloader = ArtworkDownloader(DiskCache(str(tmp_path), 1000), 5, workers)
+
+    assert downloader.get(server.url + '/missing.jpg',
+                          lambda url, path: downloaded.append(url)) is None
+    workers.submit(lambda: None).result()
+
+    assert downloaded == []
+    assert downloader.get(server.url + '/missing.jpg', None) is None
+
+
+def test_index_is_reloaded(server, workers, tmp_path):
+    downloader = ArtworkDownloader(DiskCache(str(tmp_path), 1000), 5, workers)
+    path = download(downloader, server.url + '/a.jpg')
+
+    diskCache = DiskCache(str(tmp_path), 1000)
+
+    assert diskCache.path(server.url + '/a.jpg') == path
+    assert server.requests == ['/a.jpg']
+
+
+def test_artwork_larger_than_the_cache_is_not_stored(server, workers, tmp_path):
+    downloaded = []
+    diskCache = DiskCache(str(tmp_path), 50)
+    downloader = ArtworkDownloader(diskCache, 5, workers)
+
+    assert diskCache.store(server.url + '/a.jpg', b'a' * 100) is None
+
+    downloader.get(server.url + '/a.jpg',
+                   lambda url, path: downloaded.append(url))
+    workers.submit(lambda: None).result()
+
+    assert downloaded == []
+    assert diskCache.path(server.url + '/a.jpg') is None
+
+
+def test_directory_is_created_on_first_download(server, workers, tmp_path):
+    directory = tmp_path / 'artwork'
+    downloader = ArtworkDownloader(DiskCache(str(directory), 1000), 5, workers)
+    assert not directory.exists()
+
+    assert download(downloader, server.url + '/a.jpg') is not None
+    assert directory.is_dir()
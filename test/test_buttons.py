@@ -0,0 +1,98 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from time import sleep
+
+import pytest
+
+pytest.importorskip('gi')
+
+from gi.repository import GLib  # noqa: E402
+
+from pidi_mpris.buttons import Button, Buttons  # noqa: E402
+
+
+def create_buttons(**conf):
+    buttons = Buttons({'Buttons': dict({
+        'backend': 'virtual',
+        'bouncetime': 50,
+        'long_press': 0.1,
+        'repeat_interval': 0.1,
+        'virtual_script': ''}, **conf)})
+
+    events = []
+    buttons.onPressedHandler(
+        lambda button: events.append(('pressed', button)) or True)
+    buttons.onLongPressHandler(
+        lambda button, _seconds: events.append(('longPress', button)) or True)
+    buttons.onReleasedHandler(
+        lambda button, _seconds: events.append(('released', button)))
+    buttons.onChordHandler(lambda held: events.append(('chord', held)))
+    return buttons, events
+
+
+def run_loop(seconds):
+    loop = GLib.MainLoop()
+    GLib.timeout_add(int(seconds * 1000), loop.quit)
+    loop.run()
+
+
+def test_long_press_repeats_until_release():
+    buttons, events = create_buttons()
+
+    buttons.gpio.press(Button.B)
+    run_loop(0.25)
+    buttons.gpio.release(Button.B)
+    run_loop(0.1)
+    buttons.cleanup()
+
+    assert events == [('pressed', Button.B), ('longPress', Button.B),
+                      ('longPress', Button.B), ('released', Button.B)]
+
+
+def test_release_within_bouncetime():
+    buttons, events = create_buttons(long_press=0.2)
+
+    buttons.gpio.press(Button.B)
+    sleep(0.01)
+    buttons.gpio.release(Button.B)
+    run_loop(0.4)
+    buttons.cleanup()
+
+    assert events == [('pressed', Button.B), ('released', Button.B)]
+
+
+def test_chord():
+    buttons, events = create_buttons()
+
+    buttons.gpio.press(Button.B)
+    buttons.gpio.press(Button.Y)
+    run_loop(0.25)
+    buttons.gpio.release(Button.Y)
+    buttons.gpio.release(Button.B)
+    run_loop(0.1)
+    buttons.cleanup()
+
+    assert events == [('pressed', Button.B),
+                      ('chord', frozenset({Button.B, Button.Y}))]
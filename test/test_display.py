@@ -0,0 +1,46 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import numpy as np
+from PIL import Image
+
+from pidi_mpris.display import PaletteFrame, decode_animation, to_frame
+
+
+def test_resized_gif_frames_are_palette_indexed(tmp_path):
+    imageFile = str(tmp_path / 'animation.gif')
+    # Noise with 200 colors, interpolating filters would add many more
+    rng = np.random.default_rng(1)
+    palette = rng.integers(0, 256, (200, 3), dtype=np.uint8)
+    frames = [Image.fromarray(palette[rng.integers(0, 200, (60, 100))], 'RGB')
+              for _ in range(2)]
+    frames[0].save(imageFile, save_all=True,
+                   append_images=frames[1:], duration=[100, 200], loop=0)
+
+    decoded = decode_animation(imageFile, (240, 240))
+
+    assert [duration for _image, duration in decoded] == [0.1, 0.2]
+    for image, _duration in decoded:
+        assert image.size == (240, 240)
+        assert isinstance(to_frame(image, 90), PaletteFrame)
@@ -0,0 +1,49 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import gc
+import weakref
+
+from pidi_mpris import metrics
+from pidi_mpris.cache import LRUCache
+
+
+def test_gauge_reports_the_latest_registration():
+    registry = metrics.Registry()
+    registry.gauge('test_value', 'A value', lambda: 1, cache='test')
+    registry.gauge('test_value', 'A value', lambda: 2, cache='test')
+
+    assert 'test_value{cache="test"} 2\n' in registry.collect()
+
+
+def test_replaced_cache_is_not_kept_alive():
+    cache = LRUCache(10, name='metrics-test')
+    cache.put('a', 1)
+    ref = weakref.ref(cache)
+
+    cache = LRUCache(10, name='metrics-test')
+    gc.collect()
+
+    assert ref() is None
+    assert 'pidi_cache_size{cache="metrics-test"} 0\n' in metrics.REGISTRY.collect()
@@ -0,0 +1,112 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import argparse
+import os
+
+import pytest
+
+pytest.importorskip('gi')
+
+from pidi_mpris.artwork import ArtworkCache  # noqa: E402
+from pidi_mpris.display import Display  # noqa: E402
+from pidi_mpris.main import read_conf  # noqa: E402
+from pidi_mpris.mpris import PlaybackStatus  # noqa: E402
+from pidi_mpris.screens import ArtworkScreen, NowPlayingInfoScreen  # noqa: E402
+
+
+FONTS = os.path.join(os.path.dirname(__file__), '..', 'data', 'fonts', 'OpenSans')
+
+LONG_TEXT = 'A text that is much too long to fit on a single line of the display'
+
+
+class MediaPlayer:
+    def __init__(self, **metadata):
+        self.metadata = metadata
+
+    def artist(self):
+        return self.metadata.get('artist', [])
+
+    def albumArtist(self):
+        return []
+
+    def album(self):
+        return self.metadata.get('album', '')
+
+    def title(self):
+        return self.metadata.get('title', '')
+
+    def trackNumber(self):
+        return 0
+
+    def length(self):
+        return 0
+
+    def playbackStatus(self):
+        return PlaybackStatus.PLAYING
+
+    def identity(self):
+        return ''
+
+
+def create_conf(**screenConf):
+    conf = read_conf(argparse.Namespace(
+        conf=os.devnull, log_level=None, log_filename=None))
+    for face, style in (('regular', 'Regular'), ('bold', 'Bold'), ('italic', 'Italic')):
+        conf['DEFAULT']['font_face_' + face] = os.path.join(
+            FONTS, 'OpenSans-{}.ttf'.format(style))
+    conf['Display']['backend'] = 'virtual'
+    for key, value in screenConf.items():
+        conf['NowPlayingInfoScreen'][key] = value
+    return conf
+
+
+@pytest.mark.parametrize('line', [1, 3])
+def test_marquee_outside_of_the_display_is_clipped(line):
+    conf = create_conf(**{'line{}_marquee'.format(line): 'yes'})
+    display = Display(conf)
+    mprisPlayer = MediaPlayer(artist=[LONG_TEXT], title=LONG_TEXT * 2, album=LONG_TEXT)
+    screen = NowPlayingInfoScreen(conf, display, mprisPlayer, None, None)
+
+    screen.activate()
+    screen._scroll()
+    screen.deactivate()
+    display.close()
+
+    assert screen._frame is not None
+    for _strip, _period, (_x, y, _width, height), _offset, _txt, _top in screen._marquees:
+        assert 0 <= y and y + height <= display.height
+
+
+def test_missing_fallback_artwork_is_logged(tmp_path, caplog):
+    conf = create_conf()
+    conf['ArtworkScreen']['fallback_image'] = str(tmp_path / 'missing.jpg')
+    display = Display(conf)
+    screen = ArtworkScreen(conf, display, MediaPlayer(),
+                           ArtworkCache(display, 1024 * 1024, None), None, None)
+
+    screen._loadArtwork(str(tmp_path / 'cover.jpg'))
+    display.close()
+
+    assert 'Failed to load fallback image' in caplog.text
@@ -0,0 +1,66 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import numpy as np
+from PIL import Image
+
+from pidi_mpris.theme import ThemeCache, contrast_ratio, extract_theme
+
+
+def gradient(width=300, height=300):
+    x = np.linspace(0, 255, width, dtype=np.uint8)
+    y = np.linspace(0, 255, height, dtype=np.uint8)
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    pixels[..., 0] = x[np.newaxis, :]
+    pixels[..., 1] = y[:, np.newaxis]
+    pixels[..., 2] = 128
+    return Image.fromarray(pixels, 'RGB')
+
+
+def assert_readable(theme, minContrast):
+    for role in ('default', 'primary', 'muted'):
+        assert contrast_ratio(theme.color(role), theme.background) >= minContrast - 0.01
+
+
+def test_solid_color():
+    theme = extract_theme(Image.new('RGB', (300, 300), (200, 30, 30)), 4.5)
+
+    assert theme.background == (200, 30, 30)
+    assert_readable(theme, 4.5)
+
+
+def test_gradient_without_frequent_colors():
+    theme = extract_theme(gradient(), 4.5)
+
+    assert_readable(theme, 4.5)
+
+
+def test_theme_is_cached(tmp_path):
+    imageFile = str(tmp_path / 'cover.png')
+    gradient().save(imageFile)
+    themes = ThemeCache(4.5)
+
+    assert themes.cached(imageFile) is None
+    theme = themes.get(imageFile)
+    assert themes.cached(imageFile) is theme
@@ -0,0 +1,124 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2020 Christian Meffert
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from time import monotonic, sleep
+
+import numpy as np
+from PIL import Image
+import pytest
+
+pytest.importorskip('gi')
+
+from gi.repository import GLib  # noqa: E402
+
+from pidi_mpris.buttons import Button, Buttons  # noqa: E402
+from pidi_mpris.display import Display  # noqa: E402
+
+
+# Colors without loss in RGB565
+RED = (248, 0, 0)
+BLUE = (0, 0, 248)
+GREEN = (0, 252, 0)
+
+
+@pytest.fixture
+def display():
+    display = Display({'Display': {
+        'backend': 'virtual',
+        'spi_speed': 80000000,
+        'virtual_frame_history': 16,
+        'tile_size': 16,
+        'full_update_threshold': 0.5}})
+    yield display
+    display.close()
+
+
+def wait_for_frames(display, count, timeout=2):
+    end = monotonic() + timeout
+    while display.framesSent + display.framesSkipped < count and monotonic() < end:
+        sleep(0.01)
+
+
+def run_loop(seconds):
+    loop = GLib.MainLoop()
+    GLib.timeout_add(int(seconds * 1000), loop.quit)
+    loop.run()
+
+
+def test_frames_are_recorded(display):
+    panel = display.panel
+    image = Image.new('RGB', (240, 240), RED)
+
+    display.image(image)
+    wait_for_frames(display, 1)
+
+    assert [(f.window, f.numBytes) for f in panel.frames] == [
+        ((0, 0, 239, 239), 240 * 240 * 2)]
+    assert np.array_equal(np.asarray(panel.snapshot()), np.asarray(image))
+
+    # Unchanged frames are not sent
+    display.image(image.copy())
+    wait_for_frames(display, 2)
+    assert display.framesSkipped == 1
+    assert len(panel.frames) == 1
+
+    # Only the changed tile is sent
+    changed = image.copy()
+    changed.paste(BLUE, (0, 0, 10, 10))
+    display.image(changed)
+    wait_for_frames(display, 3)
+
+    assert [f.numBytes for f in panel.frames][1:] == [16 * 16 * 2]
+    assert np.array_equal(np.asarray(panel.snapshot()), np.asarray(changed))
+
+
+def test_scripted_buttons_drive_the_display(display):
+    buttons = Buttons({'Buttons': {
+        'backend': 'virtual',
+        'bouncetime': 50,
+        'long_press': 1,
+        'repeat_interval': 1,
+        'virtual_script': '0.1 B 0.2 A+X:0.3'}})
+
+    colors = {Button.A: RED, Button.B: BLUE, Button.X: GREEN}
+    events = []
+
+    def onPressed(button):
+        events.append(('pressed', button))
+        display.image(Image.new('RGB', (240, 240), colors[button]))
+        return True
+
+    buttons.onPressedHandler(onPressed)
+    buttons.onReleasedHandler(
+        lambda button, _seconds: events.append(('released', button)))
+    buttons.onChordHandler(lambda held: events.append(('chord', held)))
+
+    run_loop(1)
+    buttons.cleanup()
+    wait_for_frames(display, 2)
+
+    assert events == [('pressed', Button.B), ('released', Button.B),
+                      ('pressed', Button.A), ('chord', frozenset({Button.A, Button.X}))]
+    assert display.framesSent == 2
+    assert display.panel.snapshot().getpixel((120, 120)) == RED